@@ -0,0 +1,170 @@
+"""Import CoStar alerts from exported mbox archives and .eml files.
+
+Messages are streamed from disk and run through the same parse and write
+stages as a Gmail sync, with parsing spread over a process pool. The
+position of the last stored message is saved after every write batch, so
+an interrupted import resumes where it stopped instead of starting over.
+"""
+import os
+import email
+import logging
+
+from database import (
+    claim_sync_job,
+    finish_sync_job,
+    get_import_progress,
+    save_import_progress,
+    reset_import_progress
+)
+from email_cache import CACHED_HEADERS
+from gmail_service import COSTAR_SENDER
+from pipeline import Pipeline
+from sync_engine import SyncProgress, parse_stage, write_stage
+from sync_jobs import job_progress, finish_job_with_result
+
+logger = logging.getLogger(__name__)
+
+# Archives the API may import from; the CLI accepts any path
+IMPORT_ARCHIVE_DIR = os.getenv("IMPORT_ARCHIVE_DIR", "archives")
+IMPORT_PARSE_WORKERS = int(os.getenv("IMPORT_PARSE_WORKERS", str(os.cpu_count() or 1)))
+IMPORT_WRITE_BATCH_EMAILS = int(os.getenv("IMPORT_WRITE_BATCH_EMAILS", "200"))
+
+
+def iter_mbox(path, start=0):
+    """Yield (raw message, offset just past it) from an mbox file.
+
+    The file is read line by line from byte offset start, which must be
+    the beginning of a "From " separator line or 0.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        lines = []
+        for line in f:
+            if line.startswith(b'From ') and lines:
+                yield b''.join(lines[1:]), offset
+                lines = []
+            lines.append(line)
+            offset += len(line)
+        if lines:
+            yield b''.join(lines[1:]), offset
+
+
+def eml_paths(directory):
+    """All .eml files under a directory, in a stable order."""
+    paths = []
+    for root, _, names in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in names if name.lower().endswith('.eml'))
+    paths.sort()
+    return paths
+
+
+def iter_eml(paths, after=None):
+    """Yield (raw message, path) for .eml files sorting after the given path."""
+    for path in paths:
+        if after is not None and path <= after:
+            continue
+        with open(path, 'rb') as f:
+            yield f.read(), path
+
+
+def message_html(message):
+    """First text/html part of a message, as get_email_html picks it."""
+    for part in message.walk():
+        if part.get_content_type() == 'text/html':
+            payload = part.get_payload(decode=True) or b''
+            return payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    return None
+
+
+def decode_message(raw, position):
+    """Decode a raw CoStar alert into a cache-style entry, or None for other mail."""
+    message = email.message_from_bytes(raw)
+    if COSTAR_SENDER not in str(message.get('from', '')).lower():
+        return None
+    headers = {name: str(message[name]) if message[name] is not None else None for name in CACHED_HEADERS}
+    message_id = message.get('message-id')
+    return {
+        'id': str(message_id).strip('<> ') if message_id else str(position),
+        'html': message_html(message),
+        'headers': headers,
+        'position': position
+    }
+
+
+def open_archive(source, position=None):
+    """Stream (raw message, position) pairs from an mbox, .eml file or .eml directory."""
+    if os.path.isdir(source):
+        return iter_eml(eml_paths(source), after=position)
+    if source.lower().endswith('.eml'):
+        return iter_eml([source], after=position)
+    return iter_mbox(source, start=position or 0)
+
+
+def import_archive(path, restart=False, workers=IMPORT_PARSE_WORKERS, progress=None):
+    """Import every CoStar alert in an archive, resuming from saved progress.
+
+    Progress only advances while every batch has been stored, so messages
+    after a failed write are read again on the next run; upserts make
+    that harmless.
+    """
+    source = os.path.abspath(path)
+    progress = progress or SyncProgress()
+    if restart:
+        reset_import_progress(source)
+    saved = get_import_progress(source)
+    position = saved['position'] if saved else None
+    last_read = {'position': position}
+
+    def decode(messages):
+        for raw, message_position in messages:
+            progress.add(messages_fetched=1)
+            last_read['position'] = message_position
+            entry = decode_message(raw, message_position)
+            if entry is not None:
+                yield entry
+
+    def checkpoint(entries):
+        if not progress.counts['errors']:
+            save_import_progress(source, entries[-1]['position'], progress=dict(progress.counts))
+
+    progress.pipeline = Pipeline(open_archive(source, position), [
+        ('read', iter),
+        ('decode', decode),
+        ('parse', parse_stage(progress, workers)),
+        ('write', write_stage(progress, None, IMPORT_WRITE_BATCH_EMAILS, on_written=checkpoint))
+    ])
+    progress.pipeline.run()
+
+    if not progress.counts['errors']:
+        save_import_progress(source, last_read['position'], status="completed", progress=dict(progress.counts))
+    progress.flush()
+    return progress.result("archive")
+
+
+def resolve_archive_path(path):
+    """Resolve an API-supplied path inside IMPORT_ARCHIVE_DIR. Raises ValueError."""
+    root = os.path.realpath(IMPORT_ARCHIVE_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved != root and not resolved.startswith(root + os.sep):
+        raise ValueError("Archive path must be inside the archive directory")
+    if not os.path.exists(resolved):
+        raise ValueError(f"Archive not found: {path}")
+    return resolved
+
+
+def start_import_job(path, restart=False):
+    """Claim the import lock for an archive. Returns (job, created)."""
+    source = os.path.abspath(path)
+    return claim_sync_job(f"import:{source}", {"path": source, "restart": restart})
+
+
+def run_import_job(job_id, path, restart=False):
+    """Run a claimed import job to completion, recording the outcome."""
+    try:
+        result = import_archive(path, restart=restart, progress=job_progress(job_id))
+    except Exception as e:
+        logger.exception("Import job %s failed", job_id)
+        finish_sync_job(job_id, "failed", error=str(e))
+    else:
+        finish_job_with_result(job_id, result)
@@ -0,0 +1,117 @@
+"""Motor-backed read path, so read endpoints can run on the event loop.
+
+Queries are built by the same helpers as database.py; writes stay on the
+synchronous client.
+"""
+import asyncio
+import os
+
+# Motor runs every operation on its own thread pool, cpu_count * 5 threads
+# unless MOTOR_MAX_WORKERS is set when it is imported. On a small host that
+# caps concurrent queries far below the connection pool, so match the pool.
+os.environ.setdefault("MOTOR_MAX_WORKERS", os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import database
+from metrics import timed, MONGO_OPERATION_SECONDS
+from database import (
+    MONGO_URI,
+    MONGO_DB_NAME,
+    client_options,
+    CHANGES_SORT,
+    HIDDEN_FIELDS,
+    build_changes_query,
+    build_page_query,
+    encode_cursor,
+    next_page_cursor,
+    properties_projection,
+    stats_from_documents,
+    stats_need_rebuild
+)
+
+client = None
+db = None
+
+
+def connect(uri: str = MONGO_URI) -> None:
+    """Create the async client. Call from a running event loop."""
+    global client, db
+    if client is not None:
+        return
+    client = AsyncIOMotorClient(uri, **client_options())
+    db = client[MONGO_DB_NAME]
+
+
+def close() -> None:
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+async def get_properties_page(
+    skip: int = 0,
+    limit: int = 50,
+    cursor: str = None,
+    sort: str = "newest",
+    fields: list = None,
+    **filters
+) -> tuple:
+    """Async counterpart of database.get_properties_page."""
+    query, sort_spec, skip = build_page_query(skip, cursor, sort, **filters)
+    with timed(MONGO_OPERATION_SECONDS.labels("find"), "mongo"):
+        docs = await (
+            db["properties"].find(query, properties_projection(fields))
+            .sort(sort_spec).skip(skip).limit(limit).batch_size(limit)
+            .to_list(length=limit)
+        )
+    return docs, next_page_cursor(docs, limit, sort)
+
+
+async def iter_properties(query: dict, projection: dict, batch_size: int):
+    """Yield every property matching a query from build_properties_query, in storage order.
+    
+    A single server-side cursor is read batch_size documents at a time.
+    """
+    cursor = db["properties"].find(query, projection).batch_size(batch_size)
+    async for doc in cursor:
+        yield doc
+
+
+async def get_changed_properties(since=None, cursor: str = None, limit: int = 50) -> tuple:
+    """Listings changed since first seen, most recently changed first, with their history.
+    
+    Returns (documents, next cursor), the cursor being None on the last
+    page. Raises ValueError for an invalid cursor.
+    """
+    query = build_changes_query(since, cursor)
+    with timed(MONGO_OPERATION_SECONDS.labels("find"), "mongo"):
+        docs = await (
+            db["properties"].find(query, HIDDEN_FIELDS)
+            .sort(CHANGES_SORT).limit(limit).batch_size(limit)
+            .to_list(length=limit)
+        )
+    next_cursor = encode_cursor(docs[-1], "updated_at") if len(docs) == limit else None
+    return docs, next_cursor
+
+
+async def get_properties_version() -> int:
+    """Async counterpart of database.get_properties_version."""
+    doc = await db["collection_versions"].find_one({"_id": "properties"})
+    return doc["version"] if doc else 0
+
+
+async def get_property_count() -> int:
+    """Get total property count."""
+    with timed(MONGO_OPERATION_SECONDS.labels("count"), "mongo"):
+        return await db["properties"].count_documents({})
+
+
+async def get_property_stats() -> dict:
+    """Get aggregate statistics from the materialized stats collection."""
+    with timed(MONGO_OPERATION_SECONDS.labels("stats"), "mongo"):
+        docs = await db["property_stats"].find({}).to_list(length=None)
+    if stats_need_rebuild(docs):
+        return await asyncio.to_thread(database.rebuild_property_stats)
+    return stats_from_documents(docs)
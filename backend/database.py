@@ -1,108 +1,860 @@
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from bson import ObjectId
+from bson.errors import InvalidId
+from collections import Counter
+from datetime import datetime, timedelta
+import base64
+import json
+import logging
 import os
+import re
 import uuid
 
-# MongoDB connection
+from email_parser import numeric_fields, content_hash, CONTENT_FIELDS
+from geo import location_fields, within_radius, zip_centroids
+from metrics import timed, count, MONGO_OPERATION_SECONDS, PROPERTIES_INGESTED
+
+logger = logging.getLogger(__name__)
+
+# MongoDB connection settings; the connection itself is opened by connect()
 MONGO_URI = os.getenv("MONGO_URL", os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
-client = MongoClient(MONGO_URI)
-db = client["costar_scraper"]
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "costar_scraper")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+client = None
+db = None
 
 # Collections
-properties_collection = db["properties"]
+properties_collection = None
+sync_state_collection = None
+stats_collection = None
+sync_jobs_collection = None
+versions_collection = None
+import_progress_collection = None
+
+# Number of processed message ids remembered per mailbox
+SYNC_SEEN_LIMIT = 5000
+
+# Dimensions counted in property_stats, and how many values the API shows
+STATS_DIMENSIONS = {"state": "by_state", "property_type": "by_type"}
+STATS_TOP_N = 10
+# property_stats document that marks the counts as missed updates; the next read rebuilds them
+STATS_STALE_ID = "stale"
+
+# A running sync job whose heartbeat is older than this is treated as dead
+SYNC_JOB_STALE_SECONDS = int(os.getenv("SYNC_JOB_STALE_SECONDS", "600"))
+
+# Upserts sent per bulk_write by insert_properties
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Versions kept in a listing's history array
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))
+
+# Order in which live updates poll for changes when change streams are unavailable
+POLL_SORT = [("updated_at", 1), ("_id", 1)]
+
+# Newest first; served by the partial index on changed listings
+CHANGES_SORT = [("updated_at", -1), ("_id", -1)]
+
+# Lowercased copies of the text filter fields, so filters can use an index
+SEARCH_KEYS = {
+    "city": "city_key",
+    "property_type": "property_type_key",
+    "search_name": "search_name_key",
+}
+
+# Internal fields left out of API responses
+HIDDEN_FIELDS = {**{key: 0 for key in SEARCH_KEYS.values()}, "content_hash": 0}
+
+# Bulky fields only returned when requested with fields=, or by /api/properties/changes
+DETAIL_FIELDS = {"history": 0}
+
+# A listing as API responses, live updates and exports send it by default
+LISTING_PROJECTION = {**HIDDEN_FIELDS, **DETAIL_FIELDS}
+
+# Newest first; _id breaks ties so keyset pages are stable
+PAGE_SORT = [("created_at", -1), ("_id", -1)]
+
+# Typed values derived from the display strings by email_parser.numeric_fields
+NUMERIC_FIELDS = ["price_usd", "price_per_sf_usd", "building_sf", "land_acres", "cap_rate_pct", "built_year"]
+
+# Range filters accepted by build_properties_query: name -> (field, operator)
+RANGE_FILTERS = {
+    "min_price": ("price_usd", "$gte"),
+    "max_price": ("price_usd", "$lte"),
+    "min_sf": ("building_sf", "$gte"),
+    "max_sf": ("building_sf", "$lte"),
+    "min_acres": ("land_acres", "$gte"),
+    "max_acres": ("land_acres", "$lte"),
+    "min_cap_rate": ("cap_rate_pct", "$gte"),
+    "max_cap_rate": ("cap_rate_pct", "$lte"),
+    "min_year_built": ("built_year", "$gte"),
+    "max_year_built": ("built_year", "$lte"),
+}
+
+# Sort options for property pages. Numeric sorts skip listings without a value.
+SORT_OPTIONS = {
+    "newest": PAGE_SORT,
+    "price_asc": [("price_usd", 1), ("_id", 1)],
+    "price_desc": [("price_usd", -1), ("_id", -1)],
+    "sf_asc": [("building_sf", 1), ("_id", 1)],
+    "sf_desc": [("building_sf", -1), ("_id", -1)],
+    "cap_rate_desc": [("cap_rate_pct", -1), ("_id", -1)],
+    "year_built_desc": [("built_year", -1), ("_id", -1)],
+}
+
+
+def client_options() -> dict:
+    """Connection pool options shared by the sync and async clients."""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+
+def connect(uri: str = MONGO_URI) -> None:
+    """Open the connection pool and bind the collections. Safe to call twice."""
+    global client, db, properties_collection, sync_state_collection, stats_collection, sync_jobs_collection
+    global versions_collection, import_progress_collection
+    if client is not None:
+        return
+    
+    client = MongoClient(uri, **client_options())
+    db = client[MONGO_DB_NAME]
+    properties_collection = db["properties"]
+    sync_state_collection = db["sync_state"]
+    stats_collection = db["property_stats"]
+    sync_jobs_collection = db["sync_jobs"]
+    versions_collection = db["collection_versions"]
+    import_progress_collection = db["import_progress"]
+
+
+def close() -> None:
+    """Close the connection pool."""
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+def ensure_indexes() -> None:
+    """Create the indexes the queries rely on."""
+    properties_collection.create_index("costar_id", unique=True)
+    properties_collection.create_index([("city", 1), ("state", 1)])
+    properties_collection.create_index("created_at")
+    # Polled by live updates when change streams are unavailable
+    properties_collection.create_index(POLL_SORT)
+    properties_collection.create_index(
+        CHANGES_SORT, name="changed_updated_at", partialFilterExpression={"change_count": {"$gt": 0}}
+    )
+    properties_collection.create_index(PAGE_SORT)
+    properties_collection.create_index([("state", 1)] + PAGE_SORT)
+    for key in SEARCH_KEYS.values():
+        properties_collection.create_index([(key, 1)] + PAGE_SORT)
+    for field in ("price_usd", "building_sf", "land_acres", "cap_rate_pct", "built_year"):
+        properties_collection.create_index([(field, 1), ("_id", 1)])
+    properties_collection.create_index([("location", "2dsphere")])
+    # At most one running sync per mailbox
+    sync_jobs_collection.create_index(
+        "lock_key", unique=True, partialFilterExpression={"status": "running"}
+    )
+
+
+def search_keys(property_data: dict) -> dict:
+    """Build the normalized search keys for a property."""
+    keys = {}
+    for field, key in SEARCH_KEYS.items():
+        value = property_data.get(field)
+        keys[key] = value.strip().lower() if isinstance(value, str) else None
+    return keys
+
+
+def _prefix_match(value: str) -> dict:
+    """Match a normalized key by case-insensitive prefix, using its index."""
+    return {"$regex": "^" + re.escape(value.strip().lower())}
+
+
+def _history_entry(property_data: dict, recorded_at: datetime) -> dict:
+    entry = {field: property_data.get(field) for field in CONTENT_FIELDS}
+    entry["content_hash"] = property_data["content_hash"]
+    entry["email_date"] = property_data.get("email_date")
+    entry["recorded_at"] = recorded_at
+    return entry
+
+
+def _ingest_writes(property_data: dict) -> tuple:
+    """Build the writes that ingest one sighting of a listing: (insert, changed, change).
+    
+    insert upserts a new costar_id along with its first history entry.
+    changed matches an existing document whose content hash differs, and
+    change applies the new content to it, appends to the capped history
+    and bumps updated_at. Each write is a no-op whenever the other one
+    applies, so their order in an unordered bulk doesn't matter, and an
+    unchanged re-sighting writes nothing.
+    """
+    now = datetime.utcnow()
+    if not property_data.get("content_hash"):
+        property_data["content_hash"] = content_hash(property_data)
+    
+    content = {
+        key: value for key, value in property_data.items()
+        if key not in ("_id", "id", "costar_id", "created_at", "updated_at")
+    }
+    content.update(search_keys(property_data))
+    content.update(numeric_fields(property_data))
+    content.update(location_fields(property_data))
+    entry = _history_entry(property_data, now)
+    
+    # Use UUID instead of ObjectId for JSON serialization
+    property_data["id"] = str(uuid.uuid4())
+    property_data["created_at"] = now
+    property_data["updated_at"] = now
+    insert = UpdateOne(
+        {"costar_id": property_data["costar_id"]},
+        {"$setOnInsert": {
+            **content, "id": property_data["id"], "created_at": now, "updated_at": now,
+            "history": [entry], "change_count": 0
+        }},
+        upsert=True
+    )
+    
+    # Documents stored before content hashes existed are left alone until backfilled
+    changed = {"costar_id": property_data["costar_id"], "content_hash": {"$exists": True, "$ne": content["content_hash"]}}
+    if property_data.get("email_date"):
+        # An older alert read late, e.g. from an archive, doesn't overwrite newer content
+        changed["email_date"] = {"$not": {"$gt": property_data["email_date"]}}
+    change = {
+        "$set": {**content, "updated_at": now},
+        "$push": {"history": {"$each": [entry], "$slice": -HISTORY_LIMIT}},
+        "$inc": {"change_count": 1}
+    }
+    return insert, changed, change
+
 
-# Create indexes
-properties_collection.create_index("costar_id", unique=True)
-properties_collection.create_index([("city", 1), ("state", 1)])
-properties_collection.create_index("created_at")
+def _ingest_operations(writes: list) -> list:
+    """Two bulk operations per (property, writes) pair, see _ingest_writes.
+    
+    The bulk change only applies while the listing keeps the state and
+    type it is counted under in the stats; _apply_recounted_changes
+    handles the rest.
+    """
+    operations = []
+    for prop, (insert, changed, change) in writes:
+        same = {dimension: prop.get(dimension) for dimension in STATS_DIMENSIONS}
+        operations.extend([insert, UpdateOne({**changed, **same}, change)])
+    return operations
 
 
-def property_exists(costar_id: str) -> bool:
-    """Check if property already exists."""
-    return properties_collection.find_one({"costar_id": costar_id}) is not None
+def _apply_recounted_changes(writes: list) -> int:
+    """Apply changes that move listings to another state or type, and move their stats.
+    
+    The $inc on the stats needs the values being replaced, which a bulk
+    update can't return. Such changes are rare, so one read finds them
+    for the whole batch and each is applied with find_one_and_update,
+    whose BEFORE document has the old values. Returns how many applied.
+    """
+    def recounted(prop, changed):
+        return {**changed, "$or": [{dimension: {"$ne": prop.get(dimension)}} for dimension in STATS_DIMENSIONS]}
+    
+    if not writes:
+        return 0
+    candidates = {
+        doc["costar_id"] for doc in properties_collection.find(
+            {"$or": [recounted(prop, changed) for prop, (_, changed, _) in writes]}, {"costar_id": 1}
+        )
+    }
+    
+    applied = 0
+    deltas = Counter()
+    for prop, (_, changed, change) in writes:
+        if prop["costar_id"] not in candidates:
+            continue
+        before = properties_collection.find_one_and_update(
+            recounted(prop, changed), change,
+            projection={dimension: 1 for dimension in STATS_DIMENSIONS},
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            # Changed by a concurrent writer since the read
+            continue
+        applied += 1
+        for dimension in STATS_DIMENSIONS:
+            old, new = before.get(dimension), prop.get(dimension)
+            if old == new:
+                continue
+            if old:
+                deltas[(dimension, old)] -= 1
+            if new:
+                deltas[(dimension, new)] += 1
+    _record_stats(deltas)
+    return applied
 
 
 def insert_property(property_data: dict) -> dict:
-    """Insert a new property if it doesn't exist."""
+    """Insert a new property, or record a change to an existing one.
+    
+    Returns the property if it was new, otherwise None.
+    """
     if not property_data.get("costar_id"):
         return None
     
-    if property_exists(property_data.get("costar_id")):
+    writes = [(property_data, _ingest_writes(property_data))]
+    try:
+        result = properties_collection.bulk_write(_ingest_operations(writes), ordered=False)
+    except BulkWriteError as e:
+        # A concurrent sync inserted the same costar_id first
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+            raise
         return None
     
-    # Use UUID instead of ObjectId for JSON serialization
-    property_data["id"] = str(uuid.uuid4())
-    property_data["created_at"] = datetime.utcnow()
-    property_data["updated_at"] = datetime.utcnow()
-    
-    result = properties_collection.insert_one(property_data)
-    property_data["_id"] = str(result.inserted_id)
+    if not result.upserted_ids:
+        if result.modified_count or _apply_recounted_changes(writes):
+            bump_properties_version()
+        return None
+    _record_inserted_stats([property_data])
+    bump_properties_version()
+    property_data["_id"] = str(result.upserted_ids[0])
     return property_data
 
 
-def get_properties(
+def insert_properties(properties: list, batch_size: int = INGEST_BATCH_SIZE) -> tuple:
+    """Insert new properties and record changes to known ones with unordered bulk writes.
+    
+    Returns (new_count, updated_count, unchanged_count). Properties
+    without a costar_id are ignored and not counted. Materialized stats
+    count new listings and follow a listing when a change moves it to
+    another state or type.
+    """
+    properties = [prop for prop in properties if prop.get("costar_id")]
+    inserted = []
+    updated = 0
+    
+    for start in range(0, len(properties), batch_size):
+        batch = properties[start:start + batch_size]
+        writes = [(prop, _ingest_writes(prop)) for prop in batch]
+        try:
+            with timed(MONGO_OPERATION_SECONDS.labels("insert"), "mongo"):
+                result = properties_collection.bulk_write(_ingest_operations(writes), ordered=False)
+            upserted_indexes = result.upserted_ids.keys()
+            modified = result.modified_count
+        except BulkWriteError as e:
+            # Upserts racing another sync fail on the unique index; those are duplicates
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            upserted_indexes = [item["index"] for item in e.details.get("upserted", [])]
+            modified = e.details.get("nModified", 0)
+        # Two operations per property, so operation i belongs to property i // 2
+        new = {index // 2 for index in upserted_indexes}
+        inserted.extend(batch[index] for index in sorted(new))
+        known = [write for index, write in enumerate(writes) if index not in new]
+        updated += modified + _apply_recounted_changes(known)
+    
+    _record_inserted_stats(inserted)
+    if inserted or updated:
+        bump_properties_version()
+    unchanged = len(properties) - len(inserted) - updated
+    count(PROPERTIES_INGESTED.labels("new"), len(inserted))
+    count(PROPERTIES_INGESTED.labels("updated"), updated)
+    count(PROPERTIES_INGESTED.labels("duplicate"), unchanged)
+    return len(inserted), updated, unchanged
+
+
+def bump_properties_version() -> int:
+    """Mark the properties data as changed, invalidating cached API responses."""
+    doc = versions_collection.find_one_and_update(
+        {"_id": "properties"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+
+def get_properties_version() -> int:
+    """Current version of the properties data; 0 before the first write."""
+    doc = versions_collection.find_one({"_id": "properties"})
+    return doc["version"] if doc else 0
+
+
+def _stats_id(dimension: str, value) -> str:
+    return f"{dimension}:{value}"
+
+
+def _stats_deltas(properties: list) -> Counter:
+    """Count properties per (dimension, value) pair."""
+    deltas = Counter()
+    for prop in properties:
+        for dimension in STATS_DIMENSIONS:
+            if prop.get(dimension):
+                deltas[(dimension, prop[dimension])] += 1
+    return deltas
+
+
+def _record_inserted_stats(properties: list) -> None:
+    """Add newly inserted properties to the materialized stats."""
+    if properties:
+        _record_stats(_stats_deltas(properties), total=len(properties))
+
+
+def _record_stats(deltas: Counter, total: int = 0) -> None:
+    """Apply count changes per (dimension, value), and to the total, with $inc.
+    
+    The listings are already stored by now, and a retry wouldn't write
+    them again, so a failure here doesn't fail the ingest. The stats are
+    marked stale instead, and the next read rebuilds them.
+    """
+    operations = []
+    if total:
+        operations.append(UpdateOne({"_id": "total"}, {"$inc": {"count": total}}, upsert=True))
+    for (dimension, value), delta in deltas.items():
+        if delta:
+            operations.append(UpdateOne(
+                {"_id": _stats_id(dimension, value)},
+                {"$inc": {"count": delta}, "$setOnInsert": {"dimension": dimension, "value": value}},
+                upsert=True
+            ))
+    if not operations:
+        return
+    try:
+        with timed(MONGO_OPERATION_SECONDS.labels("stats_update"), "mongo"):
+            stats_collection.bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        logger.warning("Stats update failed, marking stats stale: %s", e)
+        _mark_stats_stale()
+
+
+def _mark_stats_stale() -> None:
+    try:
+        stats_collection.update_one(
+            {"_id": STATS_STALE_ID}, {"$set": {"since": datetime.utcnow()}}, upsert=True
+        )
+    except PyMongoError as e:
+        logger.error("Could not mark stats stale; run `manage.py rebuild-stats`: %s", e)
+
+
+def get_sync_checkpoint(mailbox: str) -> dict:
+    """Get the last sync checkpoint for a mailbox."""
+    return sync_state_collection.find_one({"_id": mailbox})
+
+
+def save_sync_checkpoint(mailbox: str, history_id: str, message_ids: list) -> None:
+    """Record the historyId and message ids processed by a sync.
+    
+    With history_id None the saved historyId, and history_at, the time it
+    was recorded, are left as they were.
+    """
+    now = datetime.utcnow()
+    fields = {"updated_at": now}
+    if history_id is not None:
+        fields.update(history_id=str(history_id), history_at=now)
+    sync_state_collection.update_one(
+        {"_id": mailbox},
+        {
+            "$set": fields,
+            "$push": {"message_ids": {"$each": list(message_ids), "$slice": -SYNC_SEEN_LIMIT}}
+        },
+        upsert=True
+    )
+
+
+def get_import_progress(source: str) -> dict:
+    """Get the saved position of an archive import."""
+    return import_progress_collection.find_one({"_id": source})
+
+
+def save_import_progress(source: str, position, status: str = "running", progress: dict = None) -> None:
+    """Record how far an archive import has safely got."""
+    update = {"position": position, "status": status, "updated_at": datetime.utcnow()}
+    if progress is not None:
+        update["progress"] = progress
+    import_progress_collection.update_one({"_id": source}, {"$set": update}, upsert=True)
+
+
+def reset_import_progress(source: str) -> None:
+    import_progress_collection.delete_one({"_id": source})
+
+
+def _job_is_stale(job: dict) -> bool:
+    cutoff = datetime.utcnow() - timedelta(seconds=SYNC_JOB_STALE_SECONDS)
+    return job["status"] == "running" and job["updated_at"] < cutoff
+
+
+def claim_sync_job(lock_key: str, params: dict) -> tuple:
+    """Start a sync job unless one is already running for lock_key.
+    
+    Returns (job, created). When another job holds the lock it is returned
+    with created=False; a holder that stopped heartbeating is marked
+    interrupted and the lock is taken over.
+    """
+    while True:
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "lock_key": lock_key,
+            "status": "running",
+            "params": params,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None
+        }
+        try:
+            sync_jobs_collection.insert_one(job)
+            return job, True
+        except DuplicateKeyError:
+            pass
+        
+        running = sync_jobs_collection.find_one({"lock_key": lock_key, "status": "running"})
+        if running is None:
+            continue
+        if not _job_is_stale(running):
+            return running, False
+        sync_jobs_collection.update_one(
+            {"_id": running["_id"], "status": "running"},
+            {"$set": {"status": "interrupted", "finished_at": now}}
+        )
+
+
+def update_sync_job_progress(job_id: str, progress: dict) -> None:
+    """Record a job's counters; also serves as its heartbeat."""
+    sync_jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"progress": progress, "updated_at": datetime.utcnow()}}
+    )
+
+
+def finish_sync_job(job_id: str, status: str, result: dict = None, error: str = None) -> None:
+    """Mark a job completed or failed, releasing its lock."""
+    now = datetime.utcnow()
+    sync_jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"status": status, "result": result, "error": error, "updated_at": now, "finished_at": now}}
+    )
+
+
+def get_sync_job(job_id: str) -> dict:
+    """Get a sync job; a running job that stopped heartbeating reads as interrupted."""
+    job = sync_jobs_collection.find_one({"_id": job_id})
+    if job and _job_is_stale(job):
+        job["status"] = "interrupted"
+    return job
+
+
+def build_properties_query(
     city: str = None,
     state: str = None,
     property_type: str = None,
     search_name: str = None,
-    skip: int = 0,
-    limit: int = 50
-) -> list:
-    """Get properties with filters."""
+    near_zip: str = None,
+    lat: float = None,
+    lon: float = None,
+    radius_miles: float = None,
+    **ranges
+) -> dict:
+    """Build the properties filter.
+    
+    Text filters ignore case. city matches by prefix; property_type and
+    search_name come from fixed lists, so they match exactly and their
+    (key, created_at, _id) indexes can still provide the sort. Range
+    filters are the keys of RANGE_FILTERS, e.g. min_price=100000. radius_miles limits
+    results to listings around near_zip's centroid or around lat/lon.
+    Raises ValueError for an unknown ZIP or an incomplete radius search.
+    """
     query = {}
     
+    if near_zip or lat is not None or lon is not None or radius_miles is not None:
+        query["location"] = _radius_query(near_zip, lat, lon, radius_miles)
+    
     if city:
-        query["city"] = {"$regex": city, "$options": "i"}
+        query["city_key"] = _prefix_match(city)
     if state:
         query["state"] = state.upper()
     if property_type:
-        query["property_type"] = {"$regex": property_type, "$options": "i"}
+        query["property_type_key"] = property_type.strip().lower()
     if search_name:
-        query["search_name"] = {"$regex": search_name, "$options": "i"}
+        query["search_name_key"] = search_name.strip().lower()
     
-    cursor = properties_collection.find(query).skip(skip).limit(limit).sort("created_at", -1)
+    for name, value in ranges.items():
+        if name not in RANGE_FILTERS:
+            raise TypeError(f"Unknown filter: {name}")
+        if value is None:
+            continue
+        field, operator = RANGE_FILTERS[name]
+        query.setdefault(field, {})[operator] = value
     
-    properties = []
-    for prop in cursor:
-        prop["_id"] = str(prop["_id"])
-        if prop.get("email_date"):
-            prop["email_date"] = prop["email_date"].isoformat() if hasattr(prop["email_date"], 'isoformat') else str(prop["email_date"])
-        if prop.get("created_at"):
-            prop["created_at"] = prop["created_at"].isoformat() if hasattr(prop["created_at"], 'isoformat') else str(prop["created_at"])
-        properties.append(prop)
+    return query
+
+
+def _radius_query(near_zip: str, lat: float, lon: float, radius_miles: float) -> dict:
+    if radius_miles is None:
+        raise ValueError("radius_miles is required with near_zip or lat/lon")
+    if near_zip:
+        if lat is not None or lon is not None:
+            raise ValueError("Use either near_zip or lat/lon, not both")
+        if not zip_centroids.available():
+            raise ValueError("ZIP search is unavailable: no ZIP centroid table is installed")
+        centroid = zip_centroids.lookup(near_zip)
+        if centroid is None:
+            raise ValueError(f"Unknown ZIP code: {near_zip}")
+        lat, lon = centroid
+    elif lat is None or lon is None:
+        raise ValueError("lat and lon are both required, or use near_zip")
+    return within_radius(lat, lon, radius_miles)
+
+
+def build_changes_query(since: datetime = None, cursor: str = None) -> dict:
+    """Filter for listings changed since they were first seen, in CHANGES_SORT order.
     
-    return properties
+    The change_count condition lets the query use the partial index on
+    changed listings. Raises ValueError for an invalid cursor.
+    """
+    query = {"change_count": {"$gt": 0}}
+    if since is not None:
+        query["updated_at"] = {"$gte": since}
+    if cursor:
+        query = {"$and": [query, _after_cursor(cursor, "updated_at")]}
+    return query
+
+
+def encode_cursor(doc: dict, field: str = "created_at") -> str:
+    """Encode a document's sort position, by field then _id, as an opaque page cursor."""
+    payload = json.dumps({"c": doc[field].isoformat(), "i": str(doc["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a page cursor into (sort field value, _id). Raises ValueError if invalid."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(payload["c"]), ObjectId(payload["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _after_cursor(cursor: str, field: str = "created_at") -> dict:
+    """Range predicate for documents that sort after the cursor position, newest first."""
+    value, last_id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, "_id": {"$lt": last_id}}
+    ]}
+
+
+def properties_projection(fields: list = None) -> dict:
+    """Projection for property responses: the requested fields, or all public ones but DETAIL_FIELDS."""
+    if not fields:
+        return LISTING_PROJECTION
+    projection = {field: 1 for field in fields if field not in HIDDEN_FIELDS}
+    # The cursor is built from these
+    projection["created_at"] = 1
+    projection["_id"] = 1
+    return projection
+
+
+def get_properties_page(
+    skip: int = 0,
+    limit: int = 50,
+    cursor: str = None,
+    sort: str = "newest",
+    fields: list = None,
+    **filters
+) -> tuple:
+    """Get a page of raw property documents and the cursor for the next page.
+    
+    Documents are returned as stored (ObjectId and datetime values intact)
+    for a serializer that understands them. filters are passed to
+    build_properties_query and fields limits the returned fields. With a
+    cursor the query seeks straight past the previous page instead of
+    skipping, and skip is ignored; cursors are only issued for the default
+    newest-first sort. The next cursor is None on the last page. Raises
+    ValueError for an invalid cursor or sort.
+    """
+    query, sort_spec, skip = build_page_query(skip, cursor, sort, **filters)
+    with timed(MONGO_OPERATION_SECONDS.labels("find"), "mongo"):
+        docs = list(
+            properties_collection.find(query, properties_projection(fields))
+            .sort(sort_spec).skip(skip).limit(limit).batch_size(limit)
+        )
+    return docs, next_page_cursor(docs, limit, sort)
+
+
+def build_page_query(skip: int, cursor: str, sort: str, **filters) -> tuple:
+    """Build (query, sort_spec, skip) for a properties page."""
+    if sort not in SORT_OPTIONS:
+        raise ValueError(f"Invalid sort: {sort}")
+    if cursor and sort != "newest":
+        raise ValueError("Cursor pagination is only supported with sort=newest")
+    
+    query = build_properties_query(**filters)
+    sort_spec = SORT_OPTIONS[sort]
+    sort_field = sort_spec[0][0]
+    if sort_field in NUMERIC_FIELDS:
+        query.setdefault(sort_field, {})["$ne"] = None
+    if cursor:
+        query = {"$and": [query, _after_cursor(cursor)]} if query else _after_cursor(cursor)
+        skip = 0
+    
+    return query, sort_spec, skip
+
+
+def next_page_cursor(docs: list, limit: int, sort: str) -> str:
+    """Cursor for the page after docs, or None if it was the last page."""
+    if sort == "newest" and len(docs) == limit and isinstance(docs[-1].get("created_at"), datetime):
+        return encode_cursor(docs[-1])
+    return None
+
+
+def _backfill(missing_fields: list, source_fields: list, derive, batch_size: int) -> int:
+    """Set derived fields on documents that lack any of missing_fields."""
+    missing = {"$or": [{field: {"$exists": False}} for field in missing_fields]}
+    projection = {field: 1 for field in source_fields}
+    
+    updated = 0
+    batch = []
+    for doc in properties_collection.find(missing, projection).batch_size(batch_size):
+        fields = derive(doc)
+        if not fields:
+            continue
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(batch) >= batch_size:
+            updated += properties_collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += properties_collection.bulk_write(batch, ordered=False).modified_count
+    
+    if updated:
+        bump_properties_version()
+    return updated
+
+
+def backfill_search_keys(batch_size: int = 1000) -> int:
+    """Populate search keys on documents inserted before they existed."""
+    return _backfill(list(SEARCH_KEYS.values()), list(SEARCH_KEYS), search_keys, batch_size)
+
+
+def backfill_numeric_fields(batch_size: int = 1000) -> int:
+    """Populate typed numeric fields on documents inserted before they existed."""
+    source_fields = ["price", "price_per_sf", "square_feet", "property_type", "cap_rate", "year_built"]
+    return _backfill(NUMERIC_FIELDS, source_fields, numeric_fields, batch_size)
+
+
+def backfill_locations(batch_size: int = 1000) -> int:
+    """Geocode documents stored before they had a location, or whose ZIP was unknown."""
+    return _backfill(["location"], ["zip_code"], location_fields, batch_size)
+
+
+def backfill_content_hashes(batch_size: int = 1000) -> int:
+    """Hash documents stored before content hashes, so re-sightings can be compared."""
+    return _backfill(["content_hash"], list(CONTENT_FIELDS), lambda doc: {"content_hash": content_hash(doc)}, batch_size)
+
+
+def explain_properties_query(skip: int = 0, cursor: str = None, limit: int = 50, **filters) -> dict:
+    """Return the winning plan and execution stats for a newest-first properties page.
+
+    Comparing a deep skip with the cursor for the same position shows what
+    keyset pagination saves: totalKeysExamined grows with skip but not
+    with the cursor.
+    """
+    query, sort_spec, skip = build_page_query(skip, cursor, "newest", **filters)
+    explain = properties_collection.find(query).sort(sort_spec).skip(skip).limit(limit).explain()
+    stats = explain.get("executionStats", {})
+    return {
+        "winningPlan": explain["queryPlanner"]["winningPlan"],
+        "executionStats": {
+            key: stats.get(key)
+            for key in ("nReturned", "totalKeysExamined", "totalDocsExamined", "executionTimeMillis")
+        },
+    }
 
 
 def get_property_count() -> int:
     """Get total property count."""
-    return properties_collection.count_documents({})
+    with timed(MONGO_OPERATION_SECONDS.labels("count"), "mongo"):
+        return properties_collection.count_documents({})
 
 
 def get_property_stats() -> dict:
-    """Get aggregate statistics."""
-    total = properties_collection.count_documents({})
-    
-    # Count by state
-    by_state = list(properties_collection.aggregate([
-        {"$group": {"_id": "$state", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]))
-    
-    # Count by property type
-    by_type = list(properties_collection.aggregate([
-        {"$match": {"property_type": {"$ne": None}}},
-        {"$group": {"_id": "$property_type", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]))
+    """Get aggregate statistics from the materialized stats collection."""
+    with timed(MONGO_OPERATION_SECONDS.labels("stats"), "mongo"):
+        docs = list(stats_collection.find({}))
+    if stats_need_rebuild(docs):
+        return rebuild_property_stats()
+    return stats_from_documents(docs)
+
+
+def stats_need_rebuild(docs: list) -> bool:
+    """Whether stats were never built, or an update to them was missed."""
+    return not docs or any(doc["_id"] == STATS_STALE_ID for doc in docs)
+
+
+def stats_from_documents(docs: list) -> dict:
+    """Shape property_stats documents into the stats API response."""
+    stats = {"total_properties": 0}
+    for key in STATS_DIMENSIONS.values():
+        stats[key] = {}
     
-    return {
-        "total_properties": total,
-        "by_state": {item["_id"]: item["count"] for item in by_state if item["_id"]},
-        "by_type": {item["_id"]: item["count"] for item in by_type if item["_id"]}
-    }
+    docs = [doc for doc in docs if doc["_id"] != STATS_STALE_ID]
+    for doc in sorted(docs, key=lambda d: d["count"], reverse=True):
+        if doc["_id"] == "total":
+            stats["total_properties"] = doc["count"]
+            continue
+        group = stats[STATS_DIMENSIONS[doc["dimension"]]]
+        if len(group) < STATS_TOP_N and doc["count"] > 0:
+            group[doc["value"]] = doc["count"]
+    
+    return stats
+
+
+def stats_delta(properties: list) -> dict:
+    """The change newly inserted properties make to the stats API response."""
+    delta = {"total_properties": len(properties)}
+    for key in STATS_DIMENSIONS.values():
+        delta[key] = {}
+    for (dimension, value), amount in _stats_deltas(properties).items():
+        delta[STATS_DIMENSIONS[dimension]][value] = amount
+    return delta
+
+
+def rebuild_property_stats() -> dict:
+    """Recompute the materialized stats from scratch with one $facet pipeline."""
+    started = datetime.utcnow()
+    facets = {"total": [{"$count": "count"}]}
+    for dimension in STATS_DIMENSIONS:
+        facets[dimension] = [
+            {"$match": {dimension: {"$nin": [None, ""]}}},
+            {"$group": {"_id": f"${dimension}", "count": {"$sum": 1}}}
+        ]
+    result = next(properties_collection.aggregate([{"$facet": facets}]))
+    
+    total = result["total"][0]["count"] if result["total"] else 0
+    operations = [ReplaceOne({"_id": "total"}, {"count": total}, upsert=True)]
+    stats_ids = ["total"]
+    for dimension in STATS_DIMENSIONS:
+        for item in result[dimension]:
+            stats_id = _stats_id(dimension, item["_id"])
+            stats_ids.append(stats_id)
+            operations.append(ReplaceOne(
+                {"_id": stats_id},
+                {"dimension": dimension, "value": item["_id"], "count": item["count"]},
+                upsert=True
+            ))
+    
+    stats_collection.bulk_write(operations, ordered=False)
+    stats_collection.delete_many({"_id": {"$nin": stats_ids + [STATS_STALE_ID]}})
+    # Only clear the marker if no update was missed while the pipeline ran
+    stats_collection.delete_one({"_id": STATS_STALE_ID, "since": {"$lte": started}})
+    bump_properties_version()
+    return stats_from_documents(list(stats_collection.find({})))
 
 
 def seed_sample_properties() -> int:
@@ -349,10 +1101,5 @@ def seed_sample_properties() -> int:
         }
     ]
     
-    added_count = 0
-    for prop in sample_properties:
-        result = insert_property(prop)
-        if result:
-            added_count += 1
-    
+    added_count, _, _ = insert_properties(sample_properties)
     return added_count
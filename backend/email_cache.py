@@ -0,0 +1,141 @@
+import os
+import gzip
+import json
+import threading
+from collections import OrderedDict
+
+from gmail_service import get_email_html, get_email_header
+from metrics import timed, EMAIL_DECODE_SECONDS
+
+EMAIL_CACHE_DIR = os.getenv("EMAIL_CACHE_DIR", "email_cache")
+EMAIL_CACHE_MAX_BYTES = int(os.getenv("EMAIL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Headers kept alongside the decoded HTML
+CACHED_HEADERS = ('date', 'from', 'subject')
+
+
+class EmailCache:
+    """Size-bounded LRU cache of decoded alert emails, keyed by Gmail message id.
+
+    Each entry is a gzip-compressed JSON file holding the HTML body and a
+    few headers. Recency is tracked through file mtimes so the LRU order
+    survives restarts.
+    """
+
+    def __init__(self, directory=EMAIL_CACHE_DIR, max_bytes=EMAIL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = None
+        self._total_bytes = 0
+
+    def _path(self, message_id):
+        return os.path.join(self.directory, message_id[-2:], f"{message_id}.json.gz")
+
+    def _load_index(self):
+        """Build the in-memory LRU index from the files on disk."""
+        if self._index is not None:
+            return
+        files = []
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if not name.endswith('.json.gz'):
+                        continue
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name[:-len('.json.gz')], stat.st_size))
+        files.sort()
+        self._index = OrderedDict((message_id, size) for _, message_id, size in files)
+        self._total_bytes = sum(self._index.values())
+
+    def get(self, message_id):
+        """Return a cached entry, or None on a miss."""
+        with self._lock:
+            self._load_index()
+            if message_id not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(message_id)
+
+        path = self._path(message_id)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._total_bytes -= self._index.pop(message_id, 0)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, message_id, html, headers):
+        """Store decoded HTML and headers for a message."""
+        entry = {'id': message_id, 'html': html, 'headers': headers}
+        path = self._path(message_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._load_index()
+            self._total_bytes += size - self._index.pop(message_id, 0)
+            self._index[message_id] = size
+            self._evict()
+
+        return entry
+
+    def put_message(self, email_data):
+        """Decode a full Gmail message and store it."""
+        with timed(EMAIL_DECODE_SECONDS, 'decode'):
+            headers = {name: get_email_header(email_data, name) for name in CACHED_HEADERS}
+            html = get_email_html(email_data)
+        return self.put(email_data['id'], html, headers)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            message_id, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(message_id))
+            except OSError:
+                pass
+
+    def iter_entries(self):
+        """Yield every cached entry, oldest first, without touching LRU order."""
+        with self._lock:
+            self._load_index()
+            message_ids = list(self._index)
+
+        for message_id in message_ids:
+            try:
+                with gzip.open(self._path(message_id), 'rt', encoding='utf-8') as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+email_cache = EmailCache()
@@ -1,11 +1,50 @@
+import os
 import re
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
 from bs4 import BeautifulSoup
+from lxml import etree
 
+from metrics import observe, EMAIL_PARSE_SECONDS, PROPERTIES_PER_EMAIL
 
-def parse_costar_email(html_content):
+# 'bs4' (default) or 'lxml'; both produce the same property dicts
+PARSER_ENGINE = os.getenv('COSTAR_PARSER_ENGINE', 'bs4')
+
+# Worker processes for iter_parsed; 0 or 1 parses in the calling process
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0'))
+PARSE_CHUNK_SIZE = int(os.getenv('PARSE_CHUNK_SIZE', '8'))
+
+# Workers are never forked from the server, whose Mongo and pipeline
+# threads may hold locks at fork time
+PARSE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Listing fields whose change in a later alert is recorded as a new version
+CONTENT_FIELDS = (
+    'address', 'city', 'state', 'zip_code', 'property_type',
+    'square_feet', 'year_built', 'price', 'price_per_sf', 'cap_rate'
+)
+
+# Text nodes under an element, skipping script/style like BeautifulSoup's get_text
+_TEXT_NODES = etree.XPath('.//text()[not(parent::script or parent::style)]')
+
+
+def parse_costar_email(html_content, engine=None):
     """Parse CoStar email HTML and extract property data."""
+    if (engine or PARSER_ENGINE) == 'lxml':
+        return parse_costar_email_lxml(html_content)
+
     soup = BeautifulSoup(html_content, 'lxml')
-    properties = []
+    properties = {}
+    container_details = {}
     current_search_name = None
 
     all_links = soup.find_all('a', href=True)
@@ -22,21 +61,202 @@ def parse_costar_email(html_content):
 
         # Check for property links
         if 'target=PropertyAddress' in href and 'id=' in href:
-            property_data = extract_property_from_link(link, href, current_search_name)
-            if property_data and property_data.get('costar_id'):
-                existing = next((p for p in properties if p['costar_id'] == property_data['costar_id']), None)
-                if existing:
-                    for key, value in property_data.items():
-                        if value and not existing.get(key):
-                            existing[key] = value
-                else:
-                    properties.append(property_data)
+            # Image, address and city links of one listing share a container,
+            # so its details are extracted once
+            parent = link.find_parent('table') or link.find_parent('td')
+            details = None
+            if parent:
+                details = container_details.get(id(parent))
+                if details is None:
+                    details = extract_container_details(parent.get_text(' ', strip=True))
+                    container_details[id(parent)] = details
+
+            img = link.find('img')
+            property_data = build_property_data(
+                href, current_search_name, link.get_text(strip=True),
+                img.get('src') if img else None, details
+            )
+            merge_property(properties, property_data)
+
+    return _with_content_hashes(properties.values())
+
+
+def iter_parsed(items, workers=None, chunksize=None, engine=None):
+    """Parse (key, html) pairs, yielding (key, properties) in input order.
+
+    With more than one worker, chunks of emails are parsed in a process
+    pool shared with later calls. Only a few chunks per worker are in
+    flight at a time, so results stream back without reading the whole
+    input first.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    chunksize = chunksize or PARSE_CHUNK_SIZE
+    items = iter(items)
+
+    if workers <= 1:
+        for key, html_content in items:
+            yield _observed(key, *_parse_timed(html_content, engine))
+        return
+
+    pool = parse_pool(workers)
+    pending = deque()
+    try:
+        while True:
+            chunk = list(islice(items, chunksize))
+            if chunk:
+                pending.append(pool.submit(_parse_chunk, chunk, engine))
+            if pending and (not chunk or len(pending) >= workers * 2):
+                for result in pending.popleft().result():
+                    yield _observed(*result)
+            if not chunk and not pending:
+                return
+    except BrokenProcessPool:
+        _discard_pool(workers, pool)
+        raise
+    finally:
+        # The pool is shared, so work for an abandoned iteration is dropped, not awaited
+        for future in pending:
+            future.cancel()
+
+
+def parse_pool(workers):
+    """The process pool shared by every parse with this many workers, started on first use."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD)
+            )
+            _pools[workers] = pool
+        return pool
+
+
+def _discard_pool(workers, pool):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_pools():
+    """Stop every shared parser pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _parse_chunk(chunk, engine):
+    return [(key, *_parse_timed(html_content, engine)) for key, html_content in chunk]
+
+
+def _parse_timed(html_content, engine):
+    if not html_content:
+        return [], None
+    start = time.perf_counter()
+    properties = parse_costar_email(html_content, engine)
+    return properties, time.perf_counter() - start
+
+
+def _observed(key, properties, seconds):
+    """Record parse metrics in this process; pool workers only report timings."""
+    if seconds is not None:
+        observe(EMAIL_PARSE_SECONDS, seconds, 'parse')
+        observe(PROPERTIES_PER_EMAIL, len(properties))
+    return key, properties
+
+
+def parse_costar_email_lxml(html_content):
+    """Parse CoStar email HTML with lxml directly.
+
+    Produces the same output as the BeautifulSoup engine without building
+    a BeautifulSoup tree.
+    """
+    if isinstance(html_content, str):
+        html_content = html_content.encode('utf-8')
+    root = etree.fromstring(html_content, etree.HTMLParser(encoding='utf-8'))
+    if root is None:
+        return []
+
+    properties = {}
+    container_details = {}
+    current_search_name = None
+
+    for link in root.iter('a'):
+        href = link.get('href')
+        if href is None:
+            continue
+
+        if 'target=ViewAllAlerts' in href:
+            search_text = _element_text(link)
+            if search_text and 'View' not in search_text:
+                current_search_name = search_text
+            continue
+
+        if 'target=PropertyAddress' in href and 'id=' in href:
+            parent = next(link.iterancestors('table'), None)
+            if parent is None:
+                parent = next(link.iterancestors('td'), None)
+
+            details = None
+            if parent is not None:
+                details = container_details.get(parent)
+                if details is None:
+                    details = extract_container_details(_element_text(parent, ' '))
+                    container_details[parent] = details
+
+            img = next(link.iter('img'), None)
+            property_data = build_property_data(
+                href, current_search_name, _element_text(link),
+                img.get('src') if img is not None else None, details
+            )
+            merge_property(properties, property_data)
+
+    return _with_content_hashes(properties.values())
+
+
+def _element_text(element, separator=''):
+    """Equivalent of BeautifulSoup's get_text(separator, strip=True)."""
+    strings = (text.strip() for text in _TEXT_NODES(element))
+    return separator.join(text for text in strings if text)
+
+
+def content_hash(property_data):
+    """Stable hash of a listing's CONTENT_FIELDS.
+
+    Case and whitespace are ignored, so only a real change to what an
+    alert says about the listing, such as a price cut, changes the hash.
+    """
+    values = [' '.join(str(property_data.get(field) or '').split()).lower() for field in CONTENT_FIELDS]
+    return hashlib.blake2b('\x1f'.join(values).encode(), digest_size=12).hexdigest()
+
 
+def _with_content_hashes(properties):
+    properties = list(properties)
+    for property_data in properties:
+        property_data['content_hash'] = content_hash(property_data)
     return properties
 
 
-def extract_property_from_link(link, href, search_name):
-    """Extract property data from a link element."""
+def merge_property(properties, property_data):
+    """Add a property to a costar_id-keyed dict, filling gaps in an existing entry."""
+    costar_id = property_data.get('costar_id')
+    if not costar_id:
+        return
+
+    existing = properties.get(costar_id)
+    if existing is None:
+        properties[costar_id] = property_data
+        return
+
+    for key, value in property_data.items():
+        if value and not existing.get(key):
+            existing[key] = value
+
+
+def build_property_data(href, search_name, link_text, image_url, details):
+    """Build a property dict from a link's href, text and image plus its container details."""
     property_data = {
         'costar_id': None, 'address': None, 'city': None,
         'state': None, 'zip_code': None, 'property_type': None,
@@ -49,8 +269,6 @@ def extract_property_from_link(link, href, search_name):
     if costar_id:
         property_data['costar_id'] = costar_id
 
-    link_text = link.get_text(strip=True)
-
     if link_text and not link_text.startswith('http'):
         if is_address(link_text):
             property_data['address'] = link_text
@@ -58,13 +276,15 @@ def extract_property_from_link(link, href, search_name):
             parsed = parse_city_state_zip(link_text)
             property_data.update(parsed)
 
-    img = link.find('img')
-    if img and img.get('src'):
-        property_data['image_url'] = img.get('src')
+    if image_url:
+        property_data['image_url'] = image_url
 
-    parent = link.find_parent('table') or link.find_parent('td')
-    if parent:
-        property_data = extract_property_details(parent, property_data)
+    if details:
+        for key, value in details.items():
+            # A type from the link text wins over one guessed from the container
+            if key == 'property_type' and property_data.get('property_type'):
+                continue
+            property_data[key] = value
 
     return property_data
 
@@ -99,9 +319,12 @@ def parse_city_state_zip(text):
     return result
 
 
-def extract_property_details(container, property_data):
-    text = container.get_text(' ', strip=True)
+def extract_container_details(text):
+    """Extract the listing fields found in a property container's text."""
+    return extract_details_from_text(text, {})
+
 
+def extract_details_from_text(text, property_data):
     sf_match = re.search(r'([\d,]+)\s*SF', text)
     if sf_match:
         property_data['square_feet'] = sf_match.group(1).replace(',', '')
@@ -135,3 +358,70 @@ def extract_property_details(container, property_data):
                 break
 
     return property_data
+
+
+SQFT_PER_ACRE = 43560
+
+
+def _to_number(text):
+    return float(text.replace(',', ''))
+
+
+def parse_price(text):
+    """'$3,000,000' -> 3000000.0; None when not disclosed."""
+    match = re.match(r'^\s*\$([\d,]+(?:\.\d+)?)\s*$', text or '')
+    return _to_number(match.group(1)) if match else None
+
+
+def parse_price_per_sf(text):
+    """'$108.46' or '$108.46/SF' -> 108.46; per-acre and estimated ranges -> None."""
+    match = re.match(r'^\s*\$([\d,]+(?:\.\d+)?)\s*(?:/SF)?\s*$', text or '')
+    return _to_number(match.group(1)) if match else None
+
+
+def parse_area(text, property_type=None):
+    """Split a size string into (building_sf, land_acres).
+
+    Handles '3,591', '30426', '513,572 SF (11.79 AC)' and '11.79 AC'. A size
+    given in acres, or any size on a land listing, is land area rather
+    than building area.
+    """
+    text = text or ''
+    is_land = 'Land' in (property_type or '')
+
+    ac_match = re.search(r'([\d,]*\.?\d+)\s*AC', text)
+    if ac_match:
+        return None, _to_number(ac_match.group(1))
+
+    sf_match = re.match(r'^\s*([\d,]+)', text)
+    if not sf_match:
+        return None, None
+    square_feet = _to_number(sf_match.group(1))
+
+    if is_land:
+        return None, round(square_feet / SQFT_PER_ACRE, 2)
+    return int(square_feet), None
+
+
+def parse_cap_rate(text):
+    """'8.55%' -> 8.55"""
+    match = re.match(r'^\s*([\d.]+)\s*%', text or '')
+    return float(match.group(1)) if match else None
+
+
+def parse_year(text):
+    match = re.match(r'^\s*(\d{4})\s*$', str(text or ''))
+    return int(match.group(1)) if match else None
+
+
+def numeric_fields(property_data):
+    """Derive typed, queryable values from a property's display strings."""
+    building_sf, land_acres = parse_area(property_data.get('square_feet'), property_data.get('property_type'))
+    return {
+        'price_usd': parse_price(property_data.get('price')),
+        'price_per_sf_usd': parse_price_per_sf(property_data.get('price_per_sf')),
+        'building_sf': building_sf,
+        'land_acres': land_acres,
+        'cap_rate_pct': parse_cap_rate(property_data.get('cap_rate')),
+        'built_year': parse_year(property_data.get('year_built')),
+    }
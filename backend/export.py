@@ -0,0 +1,165 @@
+"""Streaming encoders for bulk property exports.
+
+Each encoder consumes an async iterator of property documents and yields
+byte chunks, so an export never holds more than one batch in memory.
+"""
+import io
+import os
+import csv
+
+from database import LISTING_PROJECTION
+from responses import dumps
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Documents fetched per cursor batch, and rows per Parquet row group
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+# Encoded bytes buffered before a chunk is sent
+EXPORT_CHUNK_BYTES = 256 * 1024
+
+# Columns of CSV and Parquet exports and their Parquet types
+EXPORT_COLUMNS = {
+    "id": "string",
+    "costar_id": "string",
+    "address": "string",
+    "city": "string",
+    "state": "string",
+    "zip_code": "string",
+    "property_type": "string",
+    "square_feet": "string",
+    "year_built": "string",
+    "price": "string",
+    "price_per_sf": "string",
+    "cap_rate": "string",
+    "price_usd": "float64",
+    "price_per_sf_usd": "float64",
+    "building_sf": "int64",
+    "land_acres": "float64",
+    "cap_rate_pct": "float64",
+    "built_year": "int64",
+    "change_count": "int64",
+    "search_name": "string",
+    "costar_url": "string",
+    "image_url": "string",
+    "email_date": "timestamp",
+    "created_at": "timestamp",
+    "updated_at": "timestamp",
+}
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_projection(export_format: str) -> dict:
+    """Fields to read for an export format."""
+    if export_format == "ndjson":
+        return {"_id": 0, **LISTING_PROJECTION}
+    return {"_id": 0, **{column: 1 for column in EXPORT_COLUMNS}}
+
+
+def encoder(export_format: str):
+    """The chunk generator for a format. Raises ValueError if it is unavailable."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format: {export_format}")
+    if export_format == "parquet" and pa is None:
+        raise ValueError("Parquet export requires pyarrow")
+    return {"ndjson": ndjson_chunks, "csv": csv_chunks, "parquet": parquet_chunks}[export_format]
+
+
+async def ndjson_chunks(docs):
+    buffer = bytearray()
+    async for doc in docs:
+        buffer += dumps(doc)
+        buffer += b"\n"
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+async def csv_chunks(docs):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    async for doc in docs:
+        writer.writerow([_csv_value(doc.get(column)) for column in EXPORT_COLUMNS])
+        if out.tell() >= EXPORT_CHUNK_BYTES:
+            yield out.getvalue().encode()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema():
+    types = {"string": pa.string(), "float64": pa.float64(), "int64": pa.int64(), "timestamp": pa.timestamp("ms")}
+    return pa.schema([(column, types[kind]) for column, kind in EXPORT_COLUMNS.items()])
+
+
+def _parquet_table(rows, schema):
+    columns = {}
+    for column, kind in EXPORT_COLUMNS.items():
+        values = [row.get(column) for row in rows]
+        if kind == "string":
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        columns[column] = values
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+async def parquet_chunks(docs):
+    """One row group per EXPORT_BATCH_SIZE documents, sent as each is written."""
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    rows = []
+    async for doc in docs:
+        rows.append(doc)
+        if len(rows) >= EXPORT_BATCH_SIZE:
+            writer.write_table(_parquet_table(rows, schema))
+            rows = []
+            yield sink.drain()
+    if rows:
+        writer.write_table(_parquet_table(rows, schema))
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,178 @@
+"""Offline ZIP code geocoding for radius search.
+
+Centroids come from a ZIP centroid table on disk: a zip/lat/lon CSV as
+written by download_zip_centroids, or the Census ZCTA Gazetteer file
+itself (tab separated, GEOID/INTPTLAT/INTPTLONG columns). The repo ships
+data/zip_centroids.csv with the ZCTA interior points of the 2022
+Gazetteer. The table is loaded once into two float arrays indexed by the
+numeric ZIP, about 800 KB for every possible code.
+"""
+import io
+import os
+import re
+import csv
+import math
+import logging
+import zipfile
+import threading
+import urllib.request
+from array import array
+
+logger = logging.getLogger(__name__)
+
+ZIP_CENTROIDS_PATH = os.getenv(
+    "ZIP_CENTROIDS_PATH", os.path.join(os.path.dirname(__file__), "data", "zip_centroids.csv")
+)
+
+# Public-domain Census ZCTA centroids, fetched by `manage.py download-zip-centroids`
+ZIP_CENTROIDS_URL = (
+    "https://www2.census.gov/geo/docs/maps-data/data/gazetteer/"
+    "2023_Gazetteer/2023_Gaz_zcta_national.zip"
+)
+
+EARTH_RADIUS_MILES = 3958.8
+
+ZIP_CODES = 100000
+
+_ZIP_COLUMNS = ("geoid", "zip", "zip_code", "zipcode", "zcta5")
+_LAT_COLUMNS = ("intptlat", "lat", "latitude")
+_LON_COLUMNS = ("intptlong", "lon", "lng", "long", "longitude")
+
+_ZIP = re.compile(r"^\s*(\d{5})(?:-\d{4})?\s*$")
+
+
+def normalize_zip(value):
+    """The integer form of a 5-digit or ZIP+4 code, or None."""
+    if isinstance(value, int):
+        return value if 0 <= value < ZIP_CODES else None
+    match = _ZIP.match(value) if isinstance(value, str) else None
+    return int(match.group(1)) if match else None
+
+
+def _column(fieldnames, candidates):
+    names = {name.strip().lower(): name for name in fieldnames}
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    raise ValueError(f"ZIP centroid table has no {candidates[0]} column")
+
+
+class ZipCentroids:
+    """ZIP code to (lat, lon) lookup, loaded from the table on first use."""
+
+    def __init__(self, path=ZIP_CENTROIDS_PATH):
+        self.path = path
+        self.size = 0
+        self._lat = None
+        self._lon = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        lat = array("f", [math.nan]) * ZIP_CODES
+        lon = array("f", [math.nan]) * ZIP_CODES
+        size = 0
+        try:
+            with open(self.path, newline="", encoding="utf-8-sig") as f:
+                delimiter = "\t" if "\t" in f.readline() else ","
+                f.seek(0)
+                reader = csv.DictReader(f, delimiter=delimiter)
+                zip_column = _column(reader.fieldnames, _ZIP_COLUMNS)
+                lat_column = _column(reader.fieldnames, _LAT_COLUMNS)
+                lon_column = _column(reader.fieldnames, _LON_COLUMNS)
+                for row in reader:
+                    code = normalize_zip(row[zip_column])
+                    if code is None:
+                        continue
+                    try:
+                        lat[code] = float(row[lat_column])
+                        lon[code] = float(row[lon_column])
+                    except (TypeError, ValueError):
+                        continue
+                    size += 1
+        except (OSError, ValueError, csv.Error) as e:
+            logger.warning("ZIP centroid table unavailable, locations disabled: %s", e)
+        self._lat, self._lon, self.size = lat, lon, size
+
+    def _ensure_loaded(self):
+        if self._lat is None:
+            with self._lock:
+                if self._lat is None:
+                    self.load()
+
+    def available(self) -> bool:
+        """Whether a table with at least one centroid is installed."""
+        self._ensure_loaded()
+        return self.size > 0
+
+    def reload(self) -> None:
+        with self._lock:
+            self.load()
+
+    def lookup(self, zip_code):
+        """(lat, lon) of a ZIP code's centroid, or None if it is unknown."""
+        code = normalize_zip(zip_code)
+        if code is None:
+            return None
+        self._ensure_loaded()
+        lat = self._lat[code]
+        if math.isnan(lat):
+            return None
+        # Stored as float32; round off the widening noise (5 places is about a meter)
+        return round(lat, 5), round(self._lon[code], 5)
+
+
+zip_centroids = ZipCentroids()
+
+
+def download_zip_centroids(url=ZIP_CENTROIDS_URL, path=ZIP_CENTROIDS_PATH) -> int:
+    """Fetch the Census ZCTA Gazetteer and install it as a zip,lat,lon CSV.
+
+    Returns the number of ZIP codes written. The file is replaced
+    atomically and the in-memory table reloaded.
+    """
+    with urllib.request.urlopen(url, timeout=120) as response:
+        archive = zipfile.ZipFile(io.BytesIO(response.read()))
+    name = next(name for name in archive.namelist() if name.endswith(".txt"))
+    with archive.open(name) as raw:
+        reader = csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig"), delimiter="\t")
+        zip_column = _column(reader.fieldnames, _ZIP_COLUMNS)
+        lat_column = _column(reader.fieldnames, _LAT_COLUMNS)
+        lon_column = _column(reader.fieldnames, _LON_COLUMNS)
+        rows = [
+            (row[zip_column].strip(), row[lat_column].strip(), row[lon_column].strip())
+            for row in reader if normalize_zip(row[zip_column]) is not None
+        ]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["zip", "lat", "lon"])
+        writer.writerows(rows)
+    os.replace(temp_path, path)
+
+    if zip_centroids.path == path:
+        zip_centroids.reload()
+    return len(rows)
+
+
+def point(lat: float, lon: float) -> dict:
+    """A GeoJSON point; GeoJSON puts longitude first."""
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def location_fields(property_data: dict) -> dict:
+    """The location field for a property, or nothing if its ZIP is unknown.
+
+    The field is left unset rather than null so a later backfill, after
+    the table is updated, picks the document up again.
+    """
+    centroid = zip_centroids.lookup(property_data.get("zip_code"))
+    if centroid is None:
+        return {}
+    return {"location": point(*centroid)}
+
+
+def within_radius(lat: float, lon: float, radius_miles: float) -> dict:
+    """Filter for locations within radius_miles of a point, on the sphere."""
+    return {"$geoWithin": {"$centerSphere": [[lon, lat], radius_miles / EARTH_RADIUS_MILES]}}
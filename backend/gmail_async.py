@@ -0,0 +1,230 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+
+from gmail_service import gmail_client, LIST_PAGE_SIZE, RETRYABLE_STATUSES
+from metrics import timed, count, GMAIL_REQUEST_SECONDS, GMAIL_RETRIES
+
+GMAIL_CONCURRENCY = int(os.getenv('GMAIL_CONCURRENCY', '10'))
+# Gmail allows 15,000 quota units per user per minute
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', '250'))
+MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 32
+
+# Quota cost of each Gmail API method
+QUOTA_UNITS = {
+    'getProfile': 1,
+    'history.list': 2,
+    'messages.list': 5,
+    'messages.get': 5,
+}
+
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# Timeouts, resets and DNS failures; OSError covers socket.timeout, ConnectionError and ssl errors
+TRANSPORT_ERRORS = (OSError, httplib2.ServerNotFoundError)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(workers):
+    """A thread pool of the given size, shared by every fetcher that uses it.
+
+    asyncio.to_thread's default pool has min(32, cpus + 4) threads, which
+    on small hosts is fewer than GMAIL_CONCURRENCY.
+    """
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail')
+            _executors[workers] = executor
+        return executor
+
+
+class TokenBucket:
+    """Async token bucket refilled at a fixed rate of quota units per second."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, units=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= units:
+                    self.tokens -= units
+                    return
+                await asyncio.sleep((units - self.tokens) / self.rate)
+
+
+class AsyncGmailFetcher:
+    """Runs Gmail API calls concurrently without blocking the event loop.
+
+    Requests are built from a shared discovery service and executed on
+    worker threads, each with its own authorized HTTP connection, since
+    httplib2 connections are not thread-safe. Concurrency is capped by a
+    semaphore and quota usage by a token bucket. Calls that are throttled,
+    hit server errors or fail in transport are retried with exponential
+    backoff.
+    """
+
+    def __init__(self, client=gmail_client, concurrency=GMAIL_CONCURRENCY,
+                 quota_per_second=GMAIL_QUOTA_UNITS_PER_SECOND):
+        self.client = client
+        self.service = client.service()
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(quota_per_second)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor = _executor(concurrency)
+        self._local = threading.local()
+
+    def _http(self):
+        creds = self.client.credentials()
+        http = getattr(self._local, 'http', None)
+        if http is None or http.credentials is not creds:
+            http = AuthorizedHttp(creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def _execute_sync(self, request):
+        try:
+            return request.execute(http=self._http())
+        except TRANSPORT_ERRORS:
+            # Don't reuse a connection that may be half-read
+            self._local.http = None
+            raise
+
+    async def execute(self, request, method):
+        """Execute a prepared API request under the rate and concurrency limits."""
+        attempt = 0
+        while True:
+            await self.bucket.acquire(QUOTA_UNITS[method])
+            async with self._semaphore:
+                try:
+                    with timed(GMAIL_REQUEST_SECONDS.labels(method), 'gmail'):
+                        loop = asyncio.get_running_loop()
+                        return await loop.run_in_executor(self._executor, self._execute_sync, request)
+                except HttpError as e:
+                    if not _should_retry(e) or attempt >= MAX_RETRIES:
+                        raise
+                except TRANSPORT_ERRORS:
+                    if attempt >= MAX_RETRIES:
+                        raise
+            count(GMAIL_RETRIES.labels(method))
+            delay = min(MAX_BACKOFF_SECONDS, 2 ** attempt) + random.random()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_profile(self):
+        request = self.service.users().getProfile(userId='me')
+        return await self.execute(request, 'getProfile')
+
+    async def list_history_message_ids(self, start_history_id):
+        """Async counterpart of gmail_service.list_history_message_ids."""
+        message_ids = []
+        page_token = None
+
+        while True:
+            request = self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            )
+            try:
+                results = await self.execute(request, 'history.list')
+            except HttpError as e:
+                if e.resp.status == 404:
+                    return None
+                raise
+
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message_ids.append(added['message']['id'])
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return message_ids
+
+    async def iter_message_ids(self, query, max_results=None, page_size=LIST_PAGE_SIZE):
+        """Yield message ids matching a query, one page at a time."""
+        page_token = None
+        yielded = 0
+
+        while True:
+            page_limit = page_size
+            if max_results:
+                page_limit = min(page_size, max_results - yielded)
+
+            request = self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=page_limit,
+                pageToken=page_token
+            )
+            results = await self.execute(request, 'messages.list')
+
+            for msg in results.get('messages', []):
+                yield msg['id']
+                yielded += 1
+                if max_results and yielded >= max_results:
+                    return
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_message(self, message_id):
+        """Fetch one full message, or None if it no longer exists."""
+        request = self.service.users().messages().get(userId='me', id=message_id, format='full')
+        try:
+            return await self.execute(request, 'messages.get')
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+
+    async def iter_messages(self, message_ids):
+        """Yield full messages in input order while keeping requests in flight."""
+        pending = deque()
+        window = self.concurrency * 2
+        try:
+            for message_id in message_ids:
+                pending.append(asyncio.ensure_future(self.get_message(message_id)))
+                if len(pending) >= window:
+                    message = await pending.popleft()
+                    if message is not None:
+                        yield message
+
+            while pending:
+                message = await pending.popleft()
+                if message is not None:
+                    yield message
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _should_retry(exception):
+    status = exception.resp.status
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        return any(reason in str(exception.content) for reason in RATE_LIMIT_REASONS)
+    return False
@@ -1,16 +1,39 @@
 import os
+import json
+import time
 import base64
+import calendar
+import threading
+from datetime import datetime, timedelta
+from itertools import islice
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+
+from metrics import timed, count, GMAIL_REQUEST_SECONDS, GMAIL_RETRIES
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 COSTAR_SENDER = 'no-reply@alerts.costar.com'
 
+# Gmail accepts up to 100 calls per batch but recommends 50 or fewer
+MAX_BATCH_SIZE = 100
+GMAIL_BATCH_SIZE = min(max(int(os.getenv('GMAIL_BATCH_SIZE', '50')), 1), MAX_BATCH_SIZE)
+LIST_PAGE_SIZE = 500
+BATCH_RETRIES = 3
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Slack on the date bound of the search that filters history, for delivery delays
+HISTORY_SEARCH_MARGIN = timedelta(days=1)
+# Refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
 
-def get_gmail_service():
-    """Authenticate and return Gmail API service."""
+
+def get_gmail_credentials():
+    """Load, refresh or create OAuth credentials for the Gmail API."""
     creds = None
 
     if os.path.exists('token.json'):
@@ -26,33 +49,253 @@ def get_gmail_service():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    return build('gmail', 'v1', credentials=creds)
+    return creds
 
 
-def get_costar_emails(service, max_results=10, after_date=None):
-    """Fetch CoStar alert emails."""
+class GmailClient:
+    """Long-lived Gmail client shared by every sync in the process.
+
+    Credentials are loaded once and refreshed shortly before they expire.
+    The service is built from the discovery document bundled with
+    google-api-python-client, parsed once. httplib2 connections are not
+    thread-safe, so each thread gets its own service and keep-alive
+    connection, reused across calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._creds = None
+        self._discovery_doc = None
+
+    def credentials(self):
+        """Return valid credentials, refreshing them ahead of expiry."""
+        with self._lock:
+            if self._creds is None:
+                self._creds = get_gmail_credentials()
+            elif self._needs_refresh():
+                self._creds.refresh(Request())
+                with open('token.json', 'w') as token:
+                    token.write(self._creds.to_json())
+            return self._creds
+
+    def _needs_refresh(self):
+        creds = self._creds
+        if not creds.valid:
+            return True
+        return creds.expiry is not None and creds.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+    def _discovery(self):
+        with self._lock:
+            if self._discovery_doc is None:
+                self._discovery_doc = json.loads(get_static_doc('gmail', 'v1'))
+            return self._discovery_doc
+
+    def service(self):
+        """Return this thread's Gmail service."""
+        creds = self.credentials()
+        service = getattr(self._local, 'service', None)
+        if service is None or self._local.creds is not creds:
+            http = AuthorizedHttp(creds, http=httplib2.Http())
+            service = build_from_document(self._discovery(), http=http)
+            self._local.service = service
+            self._local.creds = creds
+        return service
+
+
+gmail_client = GmailClient()
+
+
+def get_gmail_service():
+    """Authenticate and return Gmail API service."""
+    return gmail_client.service()
+
+
+def costar_query(after_date=None):
+    """Build the Gmail search query for CoStar alerts."""
     query = f'from:{COSTAR_SENDER}'
     if after_date:
         query += f' after:{after_date}'
+    return query
+
+
+def costar_query_since(since):
+    """CoStar alerts received after a checkpoint time (naive UTC), less HISTORY_SEARCH_MARGIN.
+
+    history.list returns every message added to the mailbox, so its ids are
+    intersected with this search before any message is downloaded.
+    """
+    after = calendar.timegm((since - HISTORY_SEARCH_MARGIN).utctimetuple())
+    return f'{costar_query()} after:{after}'
+
+
+def get_mailbox_profile(service):
+    """Return the mailbox address and its current historyId."""
+    with timed(GMAIL_REQUEST_SECONDS.labels('getProfile'), 'gmail'):
+        return service.users().getProfile(userId='me').execute()
+
+
+def list_history_message_ids(service, start_history_id):
+    """List ids of messages added since a historyId.
+
+    Returns None when Gmail no longer has history that far back, in which
+    case the caller has to fall back to a full search.
+    """
+    message_ids = []
+    page_token = None
+
+    while True:
+        try:
+            with timed(GMAIL_REQUEST_SECONDS.labels('history.list'), 'gmail'):
+                results = service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    pageToken=page_token
+                ).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message_ids.append(added['message']['id'])
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return message_ids
+
+
+def iter_message_ids(service, query, max_results=None, page_size=LIST_PAGE_SIZE):
+    """Yield message ids matching a query, following page tokens lazily."""
+    page_token = None
+    yielded = 0
+
+    while True:
+        page_limit = page_size
+        if max_results:
+            page_limit = min(page_size, max_results - yielded)
 
-    results = service.users().messages().list(
-        userId='me',
-        q=query,
-        maxResults=max_results
-    ).execute()
+        with timed(GMAIL_REQUEST_SECONDS.labels('messages.list'), 'gmail'):
+            results = service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=page_limit,
+                pageToken=page_token
+            ).execute()
 
-    messages = results.get('messages', [])
-    emails = []
+        for msg in results.get('messages', []):
+            yield msg['id']
+            yielded += 1
+            if max_results and yielded >= max_results:
+                return
 
-    for msg in messages:
-        email_data = service.users().messages().get(
-            userId='me',
-            id=msg['id'],
-            format='full'
-        ).execute()
-        emails.append(email_data)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
 
-    return emails
+
+def iter_messages(service, message_ids, batch_size=GMAIL_BATCH_SIZE):
+    """Yield full messages for an iterable of ids, one batch at a time."""
+    message_ids = iter(message_ids)
+
+    while True:
+        chunk = list(islice(message_ids, max(batch_size, 1)))
+        if not chunk:
+            return
+
+        if batch_size > 1:
+            messages = get_messages_batched(service, chunk, batch_size=batch_size)
+        else:
+            messages = (get_message(service, message_id) for message_id in chunk)
+
+        for message in messages:
+            if message is not None:
+                yield message
+
+
+def get_message(service, message_id):
+    """Fetch one full message, or None if it no longer exists."""
+    try:
+        with timed(GMAIL_REQUEST_SECONDS.labels('messages.get'), 'gmail'):
+            return service.users().messages().get(
+                userId='me',
+                id=message_id,
+                format='full'
+            ).execute()
+    except HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+
+
+def iter_costar_emails(service, max_results=None, after_date=None, batch_size=GMAIL_BATCH_SIZE):
+    """Stream CoStar alert emails across all result pages."""
+    message_ids = iter_message_ids(service, costar_query(after_date), max_results=max_results)
+    return iter_messages(service, message_ids, batch_size=batch_size)
+
+
+def get_costar_emails(service, max_results=10, after_date=None, batch_size=GMAIL_BATCH_SIZE):
+    """Fetch CoStar alert emails."""
+    return list(iter_costar_emails(service, max_results, after_date, batch_size))
+
+
+def get_messages_batched(service, message_ids, batch_size=GMAIL_BATCH_SIZE, retries=BATCH_RETRIES):
+    """Fetch full messages using Gmail batch requests, preserving input order.
+
+    Sub-requests that fail with a retryable status are re-sent in a later
+    batch; the rest of the batch is not repeated. Messages deleted since
+    they were listed come back as None.
+    """
+    batch_size = min(max(batch_size, 1), MAX_BATCH_SIZE)
+    results = [None] * len(message_ids)
+    pending = list(range(len(message_ids)))
+    attempt = 0
+
+    while pending:
+        failed = {}
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            if isinstance(exception, HttpError) and exception.resp.status == 404:
+                return
+            if exception is not None:
+                failed[index] = exception
+            else:
+                results[index] = response
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for index in pending[start:start + batch_size]:
+                batch.add(
+                    service.users().messages().get(
+                        userId='me',
+                        id=message_ids[index],
+                        format='full'
+                    ),
+                    request_id=str(index)
+                )
+            with timed(GMAIL_REQUEST_SECONDS.labels('batch'), 'gmail'):
+                batch.execute()
+
+        if not failed:
+            break
+
+        for exception in failed.values():
+            if not _is_retryable(exception) or attempt >= retries:
+                raise exception
+
+        attempt += 1
+        count(GMAIL_RETRIES.labels('batch'), len(failed))
+        time.sleep(0.5 * 2 ** attempt)
+        pending = sorted(failed)
+
+    return results
+
+
+def _is_retryable(exception):
+    return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
 
 
 def get_email_html(email_data):
@@ -77,10 +320,21 @@ def get_email_html(email_data):
     return None
 
 
-def get_email_date(email_data):
-    """Extract email date from headers."""
+def get_email_header(email_data, name):
+    """Extract a header value from email."""
     headers = email_data.get('payload', {}).get('headers', [])
     for header in headers:
-        if header['name'].lower() == 'date':
+        if header['name'].lower() == name:
             return header['value']
     return None
+
+
+def get_email_date(email_data):
+    """Extract email date from headers."""
+    return get_email_header(email_data, 'date')
+
+
+def is_costar_email(email_data):
+    """Check whether a message was sent by the CoStar alerts address."""
+    sender = get_email_header(email_data, 'from') or ''
+    return COSTAR_SENDER in sender.lower()
@@ -0,0 +1,199 @@
+"""Server-sent events for new and updated listings.
+
+One background task follows the properties collection and fans each
+batch of changes out to every connected client. It reads a MongoDB
+change stream, or polls on updated_at when the server is a standalone
+mongod without change streams. The task starts with the first subscriber
+and stops once the last one leaves.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import async_database
+from database import LISTING_PROJECTION, POLL_SORT, stats_delta
+from responses import dumps
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per client before it is told to resync instead
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "2"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+# Changes are published in batches at most this often
+LIVE_BATCH_SECONDS = 0.5
+LIVE_BATCH_LIMIT = 500
+LIVE_RETRY_SECONDS = 5
+# How far behind the newest updated_at seen polling re-reads, for writes that commit late
+LIVE_POLL_WINDOW = timedelta(seconds=float(os.getenv("LIVE_POLL_WINDOW_SECONDS", "30")))
+
+# "$changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+def sse_message(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class LiveUpdates:
+    """Fans property changes out to subscriber queues of encoded SSE messages."""
+
+    def __init__(self, queue_size=LIVE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self._task = None
+        # Set once the server turns out not to support change streams
+        self._polling = False
+        # Where polling has got to, kept across retries: the time it started,
+        # the newest updated_at seen, and the (_id, updated_at) pairs already
+        # published within LIVE_POLL_WINDOW of it
+        self._poll_since = None
+        self._poll_newest = None
+        self._poll_published = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        """Register a client. Call from the event loop."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, inserted: list, updated: list) -> None:
+        """Send a batch of changed listings, and the stats change, to every client."""
+        messages = [sse_message("properties", {"inserted": inserted, "updated": updated})]
+        if inserted:
+            messages.append(sse_message("stats", stats_delta(inserted)))
+
+        for queue in list(self.subscribers):
+            for message in messages:
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # A client that can't keep up refetches instead of replaying the backlog
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(RESYNC)
+                    break
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                if self._polling:
+                    await self._poll()
+                else:
+                    await self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED and not self._polling:
+                    logger.info("Change streams unavailable; polling for live updates")
+                    self._polling = True
+                    continue
+                logger.warning("Live updates failed: %s", e)
+                await asyncio.sleep(LIVE_RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.warning("Live updates failed: %s", e)
+                await asyncio.sleep(LIVE_RETRY_SECONDS)
+
+    async def _watch(self):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {f"fullDocument.{field}": 0 for field in LISTING_PROJECTION}}
+        ]
+        collection = async_database.db["properties"]
+        async with collection.watch(
+            pipeline, full_document="updateLookup", max_await_time_ms=int(LIVE_BATCH_SECONDS * 1000)
+        ) as stream:
+            loop = asyncio.get_running_loop()
+            inserted, updated = [], []
+            flush_at = None
+            while self.subscribers:
+                change = await stream.try_next()
+                if change is not None and change.get("fullDocument"):
+                    target = inserted if change["operationType"] == "insert" else updated
+                    target.append(change["fullDocument"])
+                    if flush_at is None:
+                        flush_at = loop.time() + LIVE_BATCH_SECONDS
+
+                pending = len(inserted) + len(updated)
+                if pending and (change is None or pending >= LIVE_BATCH_LIMIT or loop.time() >= flush_at):
+                    self.publish(inserted, updated)
+                    inserted, updated = [], []
+                    flush_at = None
+
+    async def _poll(self):
+        """Fallback for standalone servers: follow updated_at when the data version moves.
+
+        Writers stamp updated_at before their bulk write commits, so a
+        listing can become visible with an older time than ones already
+        published. Each pass re-reads LIVE_POLL_WINDOW behind the newest
+        time seen, paging by (updated_at, _id) since a bulk write stamps
+        many listings with the same millisecond, and skips versions
+        already published.
+        """
+        collection = async_database.db["properties"]
+        if self._poll_since is None:
+            self._poll_since = self._poll_newest = datetime.utcnow()
+        # Unknown after a retry, so the first pass always reads
+        version = None
+        while self.subscribers:
+            current = await async_database.get_properties_version()
+            if current != version:
+                await self._poll_window(collection)
+                version = current
+            await asyncio.sleep(LIVE_POLL_SECONDS)
+
+    async def _poll_window(self, collection):
+        floor = max(self._poll_since, self._poll_newest - LIVE_POLL_WINDOW)
+        position = (floor, None)
+        while True:
+            docs = await (
+                collection.find(_after_position(*position), LISTING_PROJECTION)
+                .sort(POLL_SORT).limit(LIVE_BATCH_LIMIT)
+                .to_list(length=LIVE_BATCH_LIMIT)
+            )
+            if not docs:
+                break
+            position = docs[-1]["updated_at"], docs[-1]["_id"]
+            self._poll_newest = max(self._poll_newest, position[0])
+
+            fresh = [doc for doc in docs if (doc["_id"], doc["updated_at"]) not in self._poll_published]
+            self._poll_published.update((doc["_id"], doc["updated_at"]) for doc in fresh)
+            if fresh:
+                inserted = [doc for doc in fresh if doc.get("created_at") == doc["updated_at"]]
+                updated = [doc for doc in fresh if doc.get("created_at") != doc["updated_at"]]
+                self.publish(inserted, updated)
+            if len(docs) < LIVE_BATCH_LIMIT:
+                break
+
+        floor = self._poll_newest - LIVE_POLL_WINDOW
+        self._poll_published = {key for key in self._poll_published if key[1] > floor}
+
+
+def _after_position(updated_at, last_id) -> dict:
+    """Documents that sort after (updated_at, last_id) in POLL_SORT order."""
+    if last_id is None:
+        return {"updated_at": {"$gt": updated_at}}
+    return {"$or": [
+        {"updated_at": {"$gt": updated_at}},
+        {"updated_at": updated_at, "_id": {"$gt": last_id}}
+    ]}
+
+
+live_updates = LiveUpdates()
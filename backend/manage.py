@@ -0,0 +1,118 @@
+"""Maintenance commands for the CoStar scraper database.
+
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import json
+
+import database
+import geo
+from archive_import import import_archive, IMPORT_PARSE_WORKERS
+
+
+def backfill_search_keys(args):
+    count = database.backfill_search_keys(batch_size=args.batch_size)
+    print(f"Updated search keys on {count} properties")
+
+
+def backfill_numeric_fields(args):
+    count = database.backfill_numeric_fields(batch_size=args.batch_size)
+    print(f"Updated numeric fields on {count} properties")
+
+
+def download_zip_centroids(args):
+    count = geo.download_zip_centroids(url=args.url)
+    print(f"Installed centroids for {count} ZIP codes at {geo.ZIP_CENTROIDS_PATH}")
+
+
+def backfill_locations(args):
+    count = database.backfill_locations(batch_size=args.batch_size)
+    print(f"Geocoded {count} properties from {database.zip_centroids.size} known ZIP codes")
+
+
+def backfill_content_hashes(args):
+    count = database.backfill_content_hashes(batch_size=args.batch_size)
+    print(f"Hashed {count} properties")
+
+
+def rebuild_stats(args):
+    before = database.get_property_stats()
+    after = database.rebuild_property_stats()
+    print(json.dumps(after, indent=2))
+    if before != after:
+        print("Materialized stats had drifted and were corrected")
+
+
+def explain(args):
+    plan = database.explain_properties_query(
+        skip=args.skip,
+        cursor=args.cursor,
+        city=args.city,
+        state=args.state,
+        property_type=args.property_type,
+        search_name=args.search_name,
+        near_zip=args.near_zip,
+        radius_miles=args.radius_miles
+    )
+    print(json.dumps(plan, indent=2, default=str))
+
+
+def import_archives(args):
+    for path in args.paths:
+        result = import_archive(path, restart=args.restart, workers=args.workers)
+        print(f"{path}: found {result['total_found']} properties, added {result['new_added']} new")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CoStar scraper maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill-search-keys", help="Add normalized search keys to existing properties")
+    backfill.add_argument("--batch-size", type=int, default=1000)
+    backfill.set_defaults(func=backfill_search_keys)
+
+    backfill_numeric = subparsers.add_parser("backfill-numeric-fields", help="Add typed price/size/cap rate fields to existing properties")
+    backfill_numeric.add_argument("--batch-size", type=int, default=1000)
+    backfill_numeric.set_defaults(func=backfill_numeric_fields)
+
+    download_zips = subparsers.add_parser("download-zip-centroids", help="Install the Census ZIP centroid table used for radius search")
+    download_zips.add_argument("--url", default=geo.ZIP_CENTROIDS_URL)
+    download_zips.set_defaults(func=download_zip_centroids, needs_db=False)
+
+    backfill_location = subparsers.add_parser("backfill-locations", help="Add ZIP centroid locations to existing properties")
+    backfill_location.add_argument("--batch-size", type=int, default=1000)
+    backfill_location.set_defaults(func=backfill_locations)
+
+    backfill_hashes = subparsers.add_parser("backfill-content-hashes", help="Hash existing properties so later alerts can record changes to them")
+    backfill_hashes.add_argument("--batch-size", type=int, default=1000)
+    backfill_hashes.set_defaults(func=backfill_content_hashes)
+
+    rebuild = subparsers.add_parser("rebuild-stats", help="Recompute property stats from scratch")
+    rebuild.set_defaults(func=rebuild_stats)
+
+    explain_parser = subparsers.add_parser("explain", help="Show the query plan for a filtered properties page")
+    explain_parser.add_argument("--city")
+    explain_parser.add_argument("--state")
+    explain_parser.add_argument("--property-type")
+    explain_parser.add_argument("--search-name")
+    explain_parser.add_argument("--near-zip")
+    explain_parser.add_argument("--radius-miles", type=float)
+    explain_parser.add_argument("--skip", type=int, default=0)
+    explain_parser.add_argument("--cursor", help="next_cursor from a previous page")
+    explain_parser.set_defaults(func=explain)
+
+    importer = subparsers.add_parser("import-archive", help="Import alerts from mbox files, .eml files or directories of .eml files")
+    importer.add_argument("paths", nargs="+")
+    importer.add_argument("--restart", action="store_true", help="Ignore saved progress and import from the beginning")
+    importer.add_argument("--workers", type=int, default=IMPORT_PARSE_WORKERS, help="Parser processes")
+    importer.set_defaults(func=import_archives)
+
+    args = parser.parse_args()
+    if getattr(args, "needs_db", True):
+        database.connect()
+        database.ensure_indexes()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
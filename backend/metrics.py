@@ -0,0 +1,137 @@
+"""Prometheus metrics for the sync and read hot paths.
+
+Timings are also added to the current request's profile when one is
+active, which the server returns as a Server-Timing header.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from starlette.datastructures import MutableHeaders
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Request header that asks for a per-stage timing breakdown
+PROFILE_HEADER = "X-Profile"
+_PROFILE_HEADER_KEY = PROFILE_HEADER.lower().encode()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "costar_http_request_seconds", "API request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+GMAIL_REQUEST_SECONDS = Histogram(
+    "costar_gmail_request_seconds", "Gmail API call latency",
+    ["method"], buckets=LATENCY_BUCKETS
+)
+GMAIL_RETRIES = Counter(
+    "costar_gmail_retries_total", "Gmail API calls retried after throttling or server errors",
+    ["method"]
+)
+EMAIL_DECODE_SECONDS = Histogram(
+    "costar_email_decode_seconds", "Time to decode an alert's MIME body",
+    buckets=LATENCY_BUCKETS
+)
+EMAIL_PARSE_SECONDS = Histogram(
+    "costar_email_parse_seconds", "parse_costar_email duration",
+    buckets=LATENCY_BUCKETS
+)
+PROPERTIES_PER_EMAIL = Histogram(
+    "costar_properties_per_email", "Properties parsed from each alert",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250)
+)
+MONGO_OPERATION_SECONDS = Histogram(
+    "costar_mongo_operation_seconds", "MongoDB query and write latency",
+    ["operation"], buckets=LATENCY_BUCKETS
+)
+PROPERTIES_INGESTED = Counter(
+    "costar_properties_ingested_total", "Parsed properties written, by outcome",
+    ["outcome"]
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    "costar_response_cache_requests_total", "Cacheable GET requests, by outcome",
+    ["outcome"]
+)
+
+_profile = ContextVar("profile", default=None)
+
+
+def observe(histogram, seconds, stage=None):
+    """Record a duration on a histogram and on the active request profile."""
+    if METRICS_ENABLED:
+        histogram.observe(seconds)
+    profile = _profile.get()
+    if profile is not None and stage:
+        profile[stage] = profile.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(histogram, stage=None):
+    """Time a block; see observe()."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(histogram, time.perf_counter() - start, stage)
+
+
+def count(counter, amount=1):
+    if METRICS_ENABLED and amount:
+        counter.inc(amount)
+
+
+def server_timing(profile, total_seconds):
+    """Format a request profile as a Server-Timing header value."""
+    stages = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in profile.items()]
+    stages.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(stages)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template.
+
+    With an X-Profile request header, the response carries a Server-Timing
+    header breaking the request down into the stages timed above.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = {} if _PROFILE_HEADER_KEY in dict(scope["headers"]) else None
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", server_timing(profile, time.perf_counter() - start)
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profile.reset(token)
+            # Label by route template so ids in paths don't create new series
+            route = scope.get("route")
+            observe(
+                HTTP_REQUEST_SECONDS.labels(scope["method"], route.path if route else "unmatched", str(status)),
+                time.perf_counter() - start
+            )
+
+
+def render():
+    """Current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
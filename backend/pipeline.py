@@ -0,0 +1,127 @@
+import os
+import time
+import queue
+import threading
+
+# Items buffered between two pipeline stages before the upstream one blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+
+_POLL_SECONDS = 0.1
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class StageStats:
+    def __init__(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+        self.started = None
+        self.finished = None
+        self.max_queue_depth = 0
+
+    def as_dict(self, output_queue):
+        end = self.finished or time.monotonic()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'busy_seconds': round(max(0.0, elapsed - self.wait_in - self.wait_out), 3),
+            'wait_in_seconds': round(self.wait_in, 3),
+            'wait_out_seconds': round(self.wait_out, 3),
+            'queue_depth': output_queue.qsize() if output_queue else 0,
+            'max_queue_depth': self.max_queue_depth
+        }
+
+
+class Pipeline:
+    """Runs generator stages on their own threads, linked by bounded queues.
+
+    Each stage is a (name, func) pair where func takes an iterable of
+    inputs and yields outputs. The first stage reads from the source; the
+    last stage may simply consume its inputs and return None. Bounded
+    queues give backpressure, so a slow stage throttles the ones feeding
+    it. If a stage raises, the others stop and run() re-raises the error.
+    """
+
+    def __init__(self, source, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.source = source
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages[:-1]]
+        self.stats = {name: StageStats() for name, _ in stages}
+        self._stop = threading.Event()
+        self._error = None
+
+    def _get(self, q, stats):
+        while True:
+            waited = time.monotonic()
+            try:
+                item = q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                stats.wait_in += time.monotonic() - waited
+                if self._stop.is_set():
+                    raise _Stopped()
+                continue
+            stats.wait_in += time.monotonic() - waited
+            if item is _DONE:
+                return
+            stats.items_in += 1
+            yield item
+
+    def _put(self, q, item, stats):
+        waited = time.monotonic()
+        while True:
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+        stats.wait_out += time.monotonic() - waited
+        stats.max_queue_depth = max(stats.max_queue_depth, q.qsize())
+
+    def _run_stage(self, index):
+        name, func = self.stages[index]
+        stats = self.stats[name]
+        stats.started = time.monotonic()
+        inputs = self.source if index == 0 else self._get(self.queues[index - 1], stats)
+        output = self.queues[index] if index < len(self.queues) else None
+        try:
+            for item in func(inputs) or ():
+                stats.items_out += 1
+                if output is not None:
+                    self._put(output, item, stats)
+            if output is not None:
+                self._put(output, _DONE, stats)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+        finally:
+            stats.finished = time.monotonic()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._run_stage, args=(index,), name=f"pipeline-{name}", daemon=True)
+            for index, (name, _) in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def stage_stats(self):
+        """Per-stage item counts, busy/wait time and output queue depth."""
+        outputs = self.queues + [None]
+        return {
+            name: self.stats[name].as_dict(output)
+            for (name, _), output in zip(self.stages, outputs)
+        }
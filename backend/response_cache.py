@@ -0,0 +1,72 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+
+def cache_key(path: str, query_params) -> str:
+    """Key a GET response by path and query string, ignoring parameter order."""
+    return path + "?" + "&".join(f"{key}={value}" for key, value in sorted(query_params.multi_items()))
+
+
+def etag(key: str, version: int) -> str:
+    """Weak ETag for a response; weak so it survives gzip encoding."""
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored on both sides
+    candidates = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+    return tag.removeprefix("W/") in candidates
+
+
+class ResponseCache:
+    """In-process LRU of serialized responses, tagged with the data version.
+
+    An entry is only served while the properties version it was built
+    from is current and it is younger than the TTL, so a write by any
+    process invalidates every cached response.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_version, created, body = entry
+            if entry_version != version or time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: str, version: int, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,44 @@
+from bson import ObjectId
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+import orjson
+
+
+def json_default(value):
+    """Encode the BSON types orjson doesn't know natively."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError
+
+
+def dumps(content) -> bytes:
+    """Serialize raw Mongo documents; datetimes are written in ISO 8601."""
+    return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """JSON response that serializes raw Mongo documents in one orjson pass.
+
+    Return it directly from an endpoint so FastAPI skips jsonable_encoder.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves some paths uncompressed.
+
+    The gzip encoder buffers streamed chunks, which would hold back
+    server-sent events until enough of them had accumulated.
+    """
+
+    def __init__(self, app, exclude_paths=(), **options):
+        super().__init__(app, **options)
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -1,21 +1,80 @@
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Request, Response, Depends
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from pymongo.errors import PyMongoError
+from datetime import datetime
+import asyncio
+import logging
 import os
+import threading
 
-from database import (
-    get_properties, 
-    get_property_count, 
-    get_property_stats,
-    insert_property,
-    seed_sample_properties
-)
-from gmail_service import get_gmail_service, get_costar_emails, get_email_html, get_email_date
-from email_parser import parse_costar_email
+import database
+import async_database
+import export
+import metrics
+import sync_engine
+from database import seed_sample_properties, get_sync_job, finish_sync_job
+from email_cache import email_cache
+from email_parser import shutdown_parse_pools
+from responses import MongoJSONResponse, StreamingAwareGZipMiddleware, dumps
+from response_cache import response_cache, cache_key, etag, etag_matches
+from gmail_async import AsyncGmailFetcher
+from sync_engine import run_sync_async
+from sync_jobs import start_sync_job, run_sync_job, job_progress, finish_job_with_result
+from live_updates import live_updates, LIVE_HEARTBEAT_SECONDS
+from archive_import import resolve_archive_path, start_import_job, run_import_job
+
+logger = logging.getLogger(__name__)
+
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+
+
+# Longest wait between attempts to create indexes while MongoDB is unreachable
+INDEX_RETRY_MAX_SECONDS = 60
+
+# Set once ensure_indexes has succeeded; writes depend on its unique indexes
+indexes_ready = threading.Event()
+
+
+async def create_indexes():
+    """Create indexes, retrying with backoff until MongoDB accepts them."""
+    delay = 1
+    while True:
+        try:
+            await asyncio.to_thread(database.ensure_indexes)
+        except PyMongoError as e:
+            logger.warning("Could not create MongoDB indexes, retrying in %ss: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INDEX_RETRY_MAX_SECONDS)
+        else:
+            indexes_ready.set()
+            return
+
+
+def require_indexes():
+    """Refuse writes until the unique costar_id and sync lock indexes exist."""
+    if not indexes_ready.is_set():
+        raise HTTPException(status_code=503, detail="Database is not ready yet, try again shortly")
 
-app = FastAPI(title="CoStar Scraper API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app):
+    database.connect()
+    async_database.connect()
+    index_task = asyncio.create_task(create_indexes())
+    yield
+    index_task.cancel()
+    await live_updates.stop()
+    await asyncio.to_thread(shutdown_parse_pools)
+    async_database.close()
+    database.close()
+
+
+app = FastAPI(title="CoStar Scraper API", version="1.0.0", lifespan=lifespan)
 
 # CORS for React frontend
 app.add_middleware(
@@ -24,7 +83,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, exclude_paths=["/api/live"])
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 
 # Pydantic Models
@@ -32,7 +94,28 @@ class SyncResponse(BaseModel):
     status: str
     total_found: int
     new_added: int
+    updated: int = 0
     duplicates_skipped: int
+    errors: int = 0
+    mode: str = "full"
+
+
+class SyncJob(BaseModel):
+    id: str
+    status: str
+    attached: bool = False
+    params: dict
+    progress: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+def sync_job_response(job: dict, attached: bool = False) -> SyncJob:
+    fields = {key: value for key, value in job.items() if key in SyncJob.model_fields}
+    return SyncJob(id=job["_id"], attached=attached, **fields)
 
 
 class SyncStatus(BaseModel):
@@ -40,45 +123,184 @@ class SyncStatus(BaseModel):
     message: str
 
 
+async def cached_json(request: Request, build) -> Response:
+    """Serve a read endpoint's JSON with an ETag and the response cache.
+    
+    The ETag combines the properties data version with the request's query,
+    so it only changes when a write bumps the version. build is awaited for
+    the content on a cache miss.
+    """
+    version = await async_database.get_properties_version()
+    key = cache_key(request.url.path, request.query_params)
+    headers = {"ETag": etag(key, version), "Cache-Control": "no-cache"}
+    
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        metrics.count(metrics.RESPONSE_CACHE_REQUESTS.labels("not_modified"))
+        return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(key, version)
+    if body is None:
+        metrics.count(metrics.RESPONSE_CACHE_REQUESTS.labels("miss"))
+        body = dumps(await build())
+        response_cache.put(key, version, body)
+    else:
+        metrics.count(metrics.RESPONSE_CACHE_REQUESTS.labels("hit"))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 # API Endpoints
 @app.get("/")
 def root():
     return {"message": "CoStar Scraper API", "version": "1.0.0"}
 
 
-@app.get("/api/properties")
-def list_properties(
+def property_filters(
     city: Optional[str] = Query(None, description="Filter by city"),
     state: Optional[str] = Query(None, description="Filter by state"),
     property_type: Optional[str] = Query(None, description="Filter by property type"),
     search_name: Optional[str] = Query(None, description="Filter by search name"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    min_sf: Optional[int] = Query(None, ge=0, description="Minimum building square feet"),
+    max_sf: Optional[int] = Query(None, ge=0, description="Maximum building square feet"),
+    min_acres: Optional[float] = Query(None, ge=0, description="Minimum land acres"),
+    max_acres: Optional[float] = Query(None, ge=0, description="Maximum land acres"),
+    min_cap_rate: Optional[float] = Query(None, ge=0),
+    max_cap_rate: Optional[float] = Query(None, ge=0),
+    min_year_built: Optional[int] = Query(None),
+    max_year_built: Optional[int] = Query(None),
+    near_zip: Optional[str] = Query(None, description="Center a radius search on this ZIP code"),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Center latitude of a radius search"),
+    lon: Optional[float] = Query(None, ge=-180, le=180, description="Center longitude of a radius search"),
+    radius_miles: Optional[float] = Query(None, gt=0, le=500, description="Radius around near_zip or lat/lon"),
+) -> dict:
+    """Query parameters shared by the endpoints that filter properties."""
+    return {
+        "city": city,
+        "state": state,
+        "property_type": property_type,
+        "search_name": search_name,
+        "min_price": min_price,
+        "max_price": max_price,
+        "min_sf": min_sf,
+        "max_sf": max_sf,
+        "min_acres": min_acres,
+        "max_acres": max_acres,
+        "min_cap_rate": min_cap_rate,
+        "max_cap_rate": max_cap_rate,
+        "min_year_built": min_year_built,
+        "max_year_built": max_year_built,
+        "near_zip": near_zip,
+        "lat": lat,
+        "lon": lon,
+        "radius_miles": radius_miles
+    }
+
+
+@app.get("/api/properties", response_class=MongoJSONResponse)
+async def list_properties(
+    request: Request,
+    filters: dict = Depends(property_filters),
+    sort: str = Query("newest", description="newest, price_asc, price_desc, sf_asc, sf_desc, cap_rate_desc or year_built_desc"),
     skip: int = Query(0, ge=0),
-    limit: int = Query(50, ge=1, le=100)
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; overrides skip"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return; history is only included when listed")
 ):
     """Get list of properties with optional filters."""
-    properties = get_properties(
-        city=city,
-        state=state,
-        property_type=property_type,
-        search_name=search_name,
-        skip=skip,
-        limit=limit
+    async def build():
+        properties, next_cursor = await async_database.get_properties_page(
+            skip=skip,
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+            **filters
+        )
+        return {"properties": properties, "count": len(properties), "next_cursor": next_cursor}
+    
+    try:
+        return await cached_json(request, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/properties/export")
+async def export_properties(
+    filters: dict = Depends(property_filters),
+    format: str = Query("ndjson", description="ndjson, csv or parquet")
+):
+    """Stream every matching property as NDJSON, CSV or Parquet."""
+    try:
+        chunks = export.encoder(format)
+        query = database.build_properties_query(**filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    docs = async_database.iter_properties(query, export.export_projection(format), export.EXPORT_BATCH_SIZE)
+    return StreamingResponse(
+        chunks(docs),
+        media_type=export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="properties.{format}"'}
     )
-    return {"properties": properties, "count": len(properties)}
+
+
+@app.get("/api/properties/changes", response_class=MongoJSONResponse)
+async def changed_properties(
+    request: Request,
+    since: Optional[datetime] = Query(None, description="Only listings changed at or after this time"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=100)
+):
+    """Listings whose price or details changed in a later alert, most recent first."""
+    async def build():
+        properties, next_cursor = await async_database.get_changed_properties(since, cursor, limit)
+        return {"properties": properties, "count": len(properties), "next_cursor": next_cursor}
+    
+    try:
+        return await cached_json(request, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/api/properties/count")
-def count_properties():
+async def count_properties(request: Request):
     """Get total property count."""
-    count = get_property_count()
-    return {"count": count}
+    async def build():
+        return {"count": await async_database.get_property_count()}
+    return await cached_json(request, build)
 
 
 @app.get("/api/properties/stats")
-def property_stats():
+async def property_stats(request: Request):
     """Get property statistics."""
-    stats = get_property_stats()
-    return stats
+    return await cached_json(request, async_database.get_property_stats)
+
+
+@app.get("/api/live")
+async def live_stream():
+    """Server-sent events: "properties" with inserted and updated listings,
+    "stats" with the change to /api/properties/stats, and "resync" when the
+    client fell behind and should refetch."""
+    async def events():
+        # Subscribed here, not before the response starts, so the finally below
+        # always runs for a queue that was created
+        queue = live_updates.subscribe()
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+        finally:
+            live_updates.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/sync-status")
@@ -95,12 +317,14 @@ def sync_status():
         return SyncStatus(configured=False, message="Gmail credentials not configured. Add credentials.json from Google Cloud Console.")
 
 
-@app.post("/api/sync-emails", response_model=SyncResponse)
+@app.post("/api/sync-emails", response_model=SyncJob, dependencies=[Depends(require_indexes)])
 def sync_emails(
+    background_tasks: BackgroundTasks,
     days_back: int = Query(7, ge=1, le=90),
-    max_emails: int = Query(50, ge=1, le=200)
+    max_emails: int = Query(50, ge=0, description="Maximum emails to process (0 for no limit)"),
+    full_scan: bool = Query(False, description="Ignore the checkpoint and rescan the whole window")
 ):
-    """Manually trigger email sync."""
+    """Start an email sync in the background, or attach to the one already running."""
     # Check if credentials exist
     if not os.path.exists('credentials.json'):
         raise HTTPException(
@@ -108,56 +332,112 @@ def sync_emails(
             detail="Gmail credentials not configured. Please add credentials.json from Google Cloud Console."
         )
     
+    params = {"days_back": days_back, "max_emails": max_emails, "full_scan": full_scan}
     try:
-        service = get_gmail_service()
-        after_date = (datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')
-        
-        emails = get_costar_emails(service, max_results=max_emails, after_date=after_date)
-        
-        total_found = 0
-        new_added = 0
-        
-        for email in emails:
-            html_content = get_email_html(email)
-            if not html_content:
-                continue
-            
-            email_date_str = get_email_date(email)
-            email_date = None
-            if email_date_str:
-                from dateutil import parser as date_parser
-                try:
-                    email_date = date_parser.parse(email_date_str)
-                except:
-                    pass
-            
-            properties = parse_costar_email(html_content)
-            total_found += len(properties)
-            
-            for prop in properties:
-                prop["email_date"] = email_date
-                result = insert_property(prop)
-                if result:
-                    new_added += 1
-        
-        return SyncResponse(
-            status="success",
-            total_found=total_found,
-            new_added=new_added,
-            duplicates_skipped=total_found - new_added
+        job, created = start_sync_job(params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if created:
+        background_tasks.add_task(run_sync_job, job["_id"], params)
+    return sync_job_response(job, attached=not created)
+
+
+@app.get("/api/sync-jobs/{job_id}", response_model=SyncJob)
+def sync_job_status(job_id: str):
+    """Get the status and progress of a sync job."""
+    job = get_sync_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return sync_job_response(job)
+
+
+@app.post("/api/sync-emails-async", response_model=SyncResponse, dependencies=[Depends(require_indexes)])
+async def sync_emails_async(
+    days_back: int = Query(7, ge=1, le=90),
+    max_emails: int = Query(50, ge=0, description="Maximum emails to process (0 for no limit)"),
+    full_scan: bool = Query(False, description="Ignore the checkpoint and rescan the whole window")
+):
+    """Trigger email sync with concurrent, rate-limited Gmail fetches."""
+    if not os.path.exists('credentials.json'):
+        raise HTTPException(
+            status_code=400, 
+            detail="Gmail credentials not configured. Please add credentials.json from Google Cloud Console."
         )
     
+    params = {"days_back": days_back, "max_emails": max_emails, "full_scan": full_scan}
+    try:
+        job, created = await asyncio.to_thread(start_sync_job, params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not created:
+        raise HTTPException(status_code=409, detail=f"Sync job {job['_id']} is already running")
+    
+    finished = False
+    try:
+        fetcher = await asyncio.to_thread(AsyncGmailFetcher)
+        result = await run_sync_async(fetcher, progress=job_progress(job["_id"]), **params)
+        await asyncio.to_thread(finish_job_with_result, job["_id"], result)
+        finished = True
     except Exception as e:
+        await asyncio.to_thread(finish_sync_job, job["_id"], "failed", error=str(e))
+        finished = True
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not finished:
+            # Cancelled, e.g. at shutdown; don't leave the job running and holding the lock
+            await asyncio.shield(asyncio.to_thread(finish_sync_job, job["_id"], "failed", error="Sync was cancelled"))
+    
+    return SyncResponse(**result)
+
+
+@app.post("/api/reparse-cache", response_model=SyncResponse, dependencies=[Depends(require_indexes)])
+def reparse_cache():
+    """Re-parse every cached alert email without calling the Gmail API."""
+    return SyncResponse(**sync_engine.reparse_cache())
 
 
-@app.post("/api/seed-sample")
+@app.post("/api/import-archive", response_model=SyncJob, dependencies=[Depends(require_indexes)])
+def import_archive(
+    background_tasks: BackgroundTasks,
+    path: str = Query(..., description="mbox file, .eml file or directory of .eml files, relative to the archive directory"),
+    restart: bool = Query(False, description="Ignore saved progress and import from the beginning")
+):
+    """Start importing an alert archive in the background; poll /api/sync-jobs/{id}."""
+    try:
+        source = resolve_archive_path(path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job, created = start_import_job(source, restart)
+    if created:
+        background_tasks.add_task(run_import_job, job["_id"], source, restart)
+    return sync_job_response(job, attached=not created)
+
+
+@app.get("/api/email-cache/stats")
+def email_cache_stats():
+    """Get email cache size and hit/miss counters."""
+    return email_cache.stats()
+
+
+@app.post("/api/seed-sample", dependencies=[Depends(require_indexes)])
 def seed_sample():
     """Seed database with sample properties from the PDF."""
     count = seed_sample_properties()
     return {"status": "success", "properties_added": count}
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+
 @app.get("/api/health")
 def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {
+        "status": "healthy" if indexes_ready.is_set() else "starting",
+        "timestamp": datetime.utcnow().isoformat()
+    }
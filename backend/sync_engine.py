@@ -0,0 +1,341 @@
+import os
+import asyncio
+import time
+import threading
+from datetime import datetime, timedelta
+from itertools import islice
+
+from dateutil import parser as date_parser
+from pymongo.errors import PyMongoError
+
+from database import insert_properties, get_sync_checkpoint, save_sync_checkpoint
+from gmail_service import (
+    get_gmail_service,
+    get_mailbox_profile,
+    list_history_message_ids,
+    iter_message_ids,
+    iter_messages,
+    costar_query,
+    costar_query_since,
+    is_costar_email,
+    GMAIL_BATCH_SIZE
+)
+from email_parser import parse_costar_email, iter_parsed
+from email_cache import email_cache
+from pipeline import Pipeline
+
+# Parsed emails whose properties are inserted together by the write stage
+SYNC_WRITE_BATCH_EMAILS = int(os.getenv("SYNC_WRITE_BATCH_EMAILS", "20"))
+
+
+class SyncProgress:
+    """Running counters for a sync, flushed to a callback every few seconds."""
+
+    FIELDS = (
+        'messages_fetched', 'emails_parsed', 'properties_found',
+        'properties_inserted', 'properties_updated', 'duplicates', 'errors'
+    )
+
+    def __init__(self, on_flush=None, interval=2.0):
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self.on_flush = on_flush
+        self.interval = interval
+        self.pipeline = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+            due = time.monotonic() - self._last_flush >= self.interval
+        if self.on_flush and due:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self.counts)
+        if self.pipeline is not None:
+            snapshot['stages'] = self.pipeline.stage_stats()
+        return snapshot
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if self.on_flush:
+            self.on_flush(self.snapshot())
+
+    def result(self, mode):
+        """Summary in the shape of the sync API response."""
+        return {
+            'status': 'partial' if self.counts['errors'] else 'success',
+            'total_found': self.counts['properties_found'],
+            'new_added': self.counts['properties_inserted'],
+            'updated': self.counts['properties_updated'],
+            'duplicates_skipped': self.counts['duplicates'],
+            'errors': self.counts['errors'],
+            'mode': mode
+        }
+
+
+def parse_alert_entries(entries, workers=None):
+    """Parse decoded alerts, in a process pool when PARSE_WORKERS > 1.
+
+    Yields (entry, properties) in input order; entries lose their HTML.
+    """
+    items = (
+        ({key: value for key, value in entry.items() if key != 'html'}, entry.get('html'))
+        for entry in entries
+    )
+    return iter_parsed(items, workers=workers)
+
+
+def email_date(entry):
+    """The alert's Date header as a datetime, or None."""
+    email_date_str = entry['headers'].get('date')
+    if email_date_str:
+        try:
+            return date_parser.parse(email_date_str)
+        except (ValueError, OverflowError):
+            pass
+    return None
+
+
+def insert_alert_properties(entry, properties):
+    """Insert properties parsed from an alert. Returns (found, added, updated)."""
+    date = email_date(entry)
+    for prop in properties:
+        prop["email_date"] = date
+    new_added, updated, _ = insert_properties(properties)
+
+    return len(properties), new_added, updated
+
+
+def fetch_stage(service):
+    """Pipeline stage: message ids -> cached entries or raw Gmail messages."""
+    def fetch(message_ids):
+        message_ids = iter(message_ids)
+        while True:
+            chunk = list(islice(message_ids, GMAIL_BATCH_SIZE))
+            if not chunk:
+                return
+
+            missing = []
+            for message_id in chunk:
+                entry = email_cache.get(message_id)
+                if entry is None:
+                    missing.append(message_id)
+                else:
+                    yield 'cached', entry
+
+            for email in iter_messages(service, missing):
+                yield 'message', email
+    return fetch
+
+
+def decode_stage(progress):
+    """Pipeline stage: decode and cache raw messages into alert entries."""
+    def decode(items):
+        for kind, item in items:
+            progress.add(messages_fetched=1)
+            if kind == 'cached':
+                yield item
+            elif is_costar_email(item):
+                yield email_cache.put_message(item)
+    return decode
+
+
+def parse_stage(progress, workers=None):
+    """Pipeline stage: alert entries -> (entry, properties)."""
+    def parse(entries):
+        for entry, properties in parse_alert_entries(entries, workers):
+            progress.add(emails_parsed=1, properties_found=len(properties))
+            yield entry, properties
+    return parse
+
+
+def write_stage(progress, processed_ids, batch_emails=SYNC_WRITE_BATCH_EMAILS, on_written=None):
+    """Pipeline stage: insert parsed properties a few emails at a time.
+
+    Emails in a batch that fails to insert are counted as errors and left
+    out of processed_ids (if given), so the next sync retries them.
+    on_written is called with each batch of entries once it is stored.
+    """
+    def write_batch(batch):
+        properties = []
+        for entry, props in batch:
+            date = email_date(entry)
+            for prop in props:
+                prop["email_date"] = date
+            properties.extend(props)
+        try:
+            new_added, updated, duplicates = insert_properties(properties)
+        except PyMongoError:
+            progress.add(errors=len(batch))
+            return
+        if processed_ids is not None:
+            processed_ids.extend(entry['id'] for entry, _ in batch)
+        progress.add(properties_inserted=new_added, properties_updated=updated, duplicates=duplicates)
+        if on_written:
+            on_written([entry for entry, _ in batch])
+
+    def write(parsed):
+        batch = []
+        for item in parsed:
+            batch.append(item)
+            if len(batch) >= batch_emails:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+    return write
+
+
+def _counted(entries, progress):
+    for entry in entries:
+        progress.add(messages_fetched=1)
+        yield entry
+
+
+def _ingest_parsed(parsed, progress, processed_ids):
+    """Insert parsed alerts, recording progress. Failed emails are not marked processed."""
+    for entry, properties in parsed:
+        progress.add(emails_parsed=1, properties_found=len(properties))
+        try:
+            found, added, updated = insert_alert_properties(entry, properties)
+        except PyMongoError:
+            progress.add(errors=1)
+            continue
+        processed_ids.append(entry['id'])
+        progress.add(properties_inserted=added, properties_updated=updated, duplicates=found - added - updated)
+
+
+def _checkpoint_history_id(profile, progress):
+    """The historyId to checkpoint, or None to keep the saved one.
+
+    Incremental syncs only list history after the checkpoint, so while any
+    alert failed to store the checkpoint stays where it was. The next sync
+    lists the failed alerts again and skips the stored ones by message id.
+    """
+    return None if progress.counts['errors'] else profile['historyId']
+
+
+def _history_start(checkpoint):
+    """(historyId, time it was saved) to list new messages from, or None."""
+    if not checkpoint or not checkpoint.get('history_id'):
+        return None
+    return checkpoint['history_id'], checkpoint.get('history_at', checkpoint['updated_at'])
+
+
+def _after_date(days_back):
+    return (datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')
+
+
+def run_sync(days_back=7, max_emails=50, full_scan=False, progress=None):
+    """Sync CoStar alerts from Gmail into the database.
+
+    Only messages added since the last checkpoint are fetched, unless
+    Gmail has expired that history or a full scan was requested. Fetching,
+    decoding, parsing and writing run as concurrent pipeline stages.
+    """
+    progress = progress or SyncProgress()
+    service = get_gmail_service()
+
+    profile = get_mailbox_profile(service)
+    mailbox = profile['emailAddress']
+    checkpoint = None if full_scan else get_sync_checkpoint(mailbox)
+
+    message_ids = None
+    history_start = _history_start(checkpoint)
+    if history_start:
+        message_ids = list_history_message_ids(service, history_start[0])
+    if message_ids:
+        alert_ids = set(iter_message_ids(service, costar_query_since(history_start[1])))
+        message_ids = [message_id for message_id in message_ids if message_id in alert_ids]
+    mode = "incremental" if message_ids is not None else "full"
+    if message_ids is None:
+        message_ids = iter_message_ids(service, costar_query(_after_date(days_back)), max_results=max_emails or None)
+
+    seen_ids = set(checkpoint.get('message_ids', [])) if checkpoint else set()
+    message_ids = (message_id for message_id in message_ids if message_id not in seen_ids)
+
+    processed_ids = []
+    progress.pipeline = Pipeline(message_ids, [
+        ('fetch', fetch_stage(service)),
+        ('decode', decode_stage(progress)),
+        ('parse', parse_stage(progress)),
+        ('write', write_stage(progress, processed_ids))
+    ])
+    progress.pipeline.run()
+
+    save_sync_checkpoint(mailbox, _checkpoint_history_id(profile, progress), processed_ids)
+    progress.flush()
+    return progress.result(mode)
+
+
+async def run_sync_async(fetcher, days_back=7, max_emails=50, full_scan=False, progress=None):
+    """run_sync with concurrent, rate-limited Gmail fetches through an AsyncGmailFetcher."""
+    progress = progress or SyncProgress()
+
+    profile = await fetcher.get_profile()
+    mailbox = profile['emailAddress']
+    checkpoint = None if full_scan else await asyncio.to_thread(get_sync_checkpoint, mailbox)
+
+    message_ids = None
+    history_start = _history_start(checkpoint)
+    if history_start:
+        message_ids = await fetcher.list_history_message_ids(history_start[0])
+    if message_ids:
+        alert_ids = {m async for m in fetcher.iter_message_ids(costar_query_since(history_start[1]))}
+        message_ids = [message_id for message_id in message_ids if message_id in alert_ids]
+    mode = "incremental" if message_ids is not None else "full"
+    if message_ids is None:
+        query = costar_query(_after_date(days_back))
+        message_ids = [m async for m in fetcher.iter_message_ids(query, max_results=max_emails or None)]
+
+    seen_ids = set(checkpoint.get('message_ids', [])) if checkpoint else set()
+
+    processed_ids = []
+
+    # Runs on a worker thread: parsing, the Mongo write and progress flushes all block
+    def ingest(entry):
+        progress.add(messages_fetched=1)
+        html_content = entry.get('html')
+        properties = parse_costar_email(html_content) if html_content else []
+        _ingest_parsed([(entry, properties)], progress, processed_ids)
+
+    def ingest_cached(message_id):
+        # The cache gunzips and parses JSON from disk; keep that off the event loop
+        entry = email_cache.get(message_id)
+        if entry is not None:
+            ingest(entry)
+        return entry is not None
+
+    def ingest_message(email):
+        ingest(email_cache.put_message(email))
+
+    # Cached alerts are ingested as they are read; only the ids to fetch are kept
+    missing = []
+    for message_id in message_ids:
+        if message_id not in seen_ids and not await asyncio.to_thread(ingest_cached, message_id):
+            missing.append(message_id)
+
+    async for email in fetcher.iter_messages(missing):
+        if is_costar_email(email):
+            await asyncio.to_thread(ingest_message, email)
+
+    await asyncio.to_thread(save_sync_checkpoint, mailbox, _checkpoint_history_id(profile, progress), processed_ids)
+    await asyncio.to_thread(progress.flush)
+    return progress.result(mode)
+
+
+def reparse_cache(progress=None):
+    """Re-parse every cached alert email without calling the Gmail API."""
+    progress = progress or SyncProgress()
+    entries = _counted(email_cache.iter_entries(), progress)
+    progress.pipeline = Pipeline(entries, [
+        ('parse', parse_stage(progress)),
+        ('write', write_stage(progress, None))
+    ])
+    progress.pipeline.run()
+    progress.flush()
+    return progress.result("cache")
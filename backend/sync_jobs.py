@@ -0,0 +1,42 @@
+import logging
+
+from database import claim_sync_job, update_sync_job_progress, finish_sync_job
+from gmail_service import get_gmail_service, get_mailbox_profile
+from sync_engine import SyncProgress, run_sync
+
+logger = logging.getLogger(__name__)
+
+
+def sync_lock_key() -> str:
+    """Syncs are serialized per mailbox."""
+    return get_mailbox_profile(get_gmail_service())['emailAddress']
+
+
+def start_sync_job(params: dict) -> tuple:
+    """Claim the mailbox's sync lock. Returns (job, created) as claim_sync_job does."""
+    return claim_sync_job(sync_lock_key(), params)
+
+
+def job_progress(job_id: str) -> SyncProgress:
+    """Progress counters that are persisted on the job as they change."""
+    return SyncProgress(on_flush=lambda counts: update_sync_job_progress(job_id, counts))
+
+
+def finish_job_with_result(job_id: str, result: dict) -> None:
+    """Record a finished run; one that couldn't store every alert is failed."""
+    if result['errors']:
+        error = f"{result['errors']} alerts could not be stored; running it again retries them"
+        finish_sync_job(job_id, "failed", result=result, error=error)
+    else:
+        finish_sync_job(job_id, "completed", result=result)
+
+
+def run_sync_job(job_id: str, params: dict) -> None:
+    """Run a claimed sync job to completion, recording the outcome."""
+    try:
+        result = run_sync(progress=job_progress(job_id), **params)
+    except Exception as e:
+        logger.exception("Sync job %s failed", job_id)
+        finish_sync_job(job_id, "failed", error=str(e))
+    else:
+        finish_job_with_result(job_id, result)
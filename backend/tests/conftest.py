@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules are imported by their flat names, as the server does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """database and async_database bound to one in-memory mongomock client."""
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import database
+    import async_database
+
+    shared = mongomock.MongoClient()
+    monkeypatch.setattr(database, "client", None)
+    monkeypatch.setattr(database, "MongoClient", lambda uri, **options: shared)
+    monkeypatch.setattr(async_database, "client", None)
+    monkeypatch.setattr(
+        async_database, "AsyncIOMotorClient",
+        lambda uri, **options: mongomock_motor.AsyncMongoMockClient(mock_mongo_client=shared)
+    )
+    database.connect()
+    database.ensure_indexes()
+    async_database.connect()
+    return database
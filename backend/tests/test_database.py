@@ -0,0 +1,135 @@
+"""Listing ingest: new listings, re-sightings, changes and the stats they feed."""
+from datetime import datetime, timedelta
+
+from pymongo.errors import AutoReconnect
+
+SENT = datetime(2026, 3, 2, 9, 30)
+
+
+def listing(costar_id="1431229", email_date=SENT, **fields):
+    prop = {
+        "costar_id": costar_id,
+        "address": "2695 Gilchrist Rd",
+        "city": "Akron",
+        "state": "OH",
+        "zip_code": "44305",
+        "property_type": "Fast Food",
+        "price": "$1,250,000",
+        "search_name": "Ohio 70 Mile",
+        "email_date": email_date,
+    }
+    prop.update(fields)
+    return prop
+
+
+def ingest(db, properties):
+    # mongomock numbers upserts among upserts rather than by operation
+    # index, so keep to one listing, two operations, per bulk write
+    return db.insert_properties(properties, batch_size=1)
+
+
+def stored(db, costar_id="1431229"):
+    return db.properties_collection.find_one({"costar_id": costar_id})
+
+
+def test_new_listing_is_inserted_with_first_history_entry(mongo):
+    assert ingest(mongo, [listing(), listing("9001", address="1200 W Market St")]) == (2, 0, 0)
+
+    doc = stored(mongo)
+    assert doc["change_count"] == 0
+    assert doc["created_at"] == doc["updated_at"]
+    assert [entry["price"] for entry in doc["history"]] == ["$1,250,000"]
+    assert doc["content_hash"] == doc["history"][0]["content_hash"]
+    assert mongo.get_property_stats()["total_properties"] == 2
+
+
+def test_unchanged_resighting_writes_nothing(mongo):
+    ingest(mongo, [listing()])
+    before = stored(mongo)
+    version = mongo.get_properties_version()
+
+    # Whitespace and case don't count as a change
+    assert ingest(mongo, [listing(address="2695  GILCHRIST RD")]) == (0, 0, 1)
+
+    assert stored(mongo) == before
+    assert mongo.get_properties_version() == version
+
+
+def test_change_updates_content_and_appends_history(mongo):
+    ingest(mongo, [listing()])
+
+    later = SENT + timedelta(days=1)
+    assert ingest(mongo, [listing(price="$1,100,000", email_date=later)]) == (0, 1, 0)
+
+    doc = stored(mongo)
+    assert doc["price"] == "$1,100,000"
+    assert doc["price_usd"] == 1100000
+    assert doc["change_count"] == 1
+    assert doc["updated_at"] > doc["created_at"]
+    assert [entry["price"] for entry in doc["history"]] == ["$1,250,000", "$1,100,000"]
+
+
+def test_history_is_capped(mongo, monkeypatch):
+    monkeypatch.setattr(mongo, "HISTORY_LIMIT", 3)
+    prices = [f"${amount},000" for amount in range(900, 905)]
+    for day, price in enumerate(prices):
+        ingest(mongo, [listing(price=price, email_date=SENT + timedelta(days=day))])
+
+    doc = stored(mongo)
+    assert doc["change_count"] == 4
+    assert [entry["price"] for entry in doc["history"]] == prices[-3:]
+
+
+def test_older_alert_does_not_overwrite_newer_content(mongo):
+    ingest(mongo, [listing(price="$1,100,000")])
+
+    # Read late, e.g. from an archive import
+    older = SENT - timedelta(days=30)
+    assert ingest(mongo, [listing(price="$1,500,000", email_date=older)]) == (0, 0, 1)
+
+    doc = stored(mongo)
+    assert doc["price"] == "$1,100,000"
+    assert len(doc["history"]) == 1
+
+
+def test_content_hash_backfill_enables_change_tracking(mongo):
+    # Stored before content hashes existed
+    mongo.properties_collection.insert_one({**listing(), "created_at": SENT, "updated_at": SENT})
+    assert ingest(mongo, [listing(price="$999,000")]) == (0, 0, 1)
+    assert stored(mongo)["price"] == "$1,250,000"
+
+    assert mongo.backfill_content_hashes() == 1
+    assert mongo.backfill_content_hashes() == 0
+    assert ingest(mongo, [listing()]) == (0, 0, 1)
+    assert ingest(mongo, [listing(price="$999,000")]) == (0, 1, 0)
+    assert stored(mongo)["price"] == "$999,000"
+
+
+def test_change_of_state_or_type_moves_stats(mongo):
+    ingest(mongo, [listing(), listing("9001", property_type="Retail")])
+
+    moved = listing(state="PA", property_type="Retail", email_date=SENT + timedelta(days=1))
+    assert ingest(mongo, [moved, listing("9001", property_type="Retail")]) == (0, 1, 1)
+
+    stats = mongo.get_property_stats()
+    assert stats["total_properties"] == 2
+    assert stats["by_state"] == {"OH": 1, "PA": 1}
+    assert stats["by_type"] == {"Retail": 2}
+    assert stats == mongo.rebuild_property_stats()
+    assert stored(mongo)["history"][-1]["state"] == "PA"
+
+
+def test_failed_stats_update_marks_stats_stale(mongo, monkeypatch):
+    mongo.get_property_stats()
+
+    def unavailable(*args, **kwargs):
+        raise AutoReconnect("stats shard down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(mongo.stats_collection, "bulk_write", unavailable)
+        # The listings are stored; only the stats update is lost
+        assert ingest(mongo, [listing(), listing("9001")]) == (2, 0, 0)
+
+    assert mongo.stats_collection.find_one({"_id": mongo.STATS_STALE_ID})
+    assert mongo.get_property_stats()["total_properties"] == 2
+    assert mongo.stats_collection.find_one({"_id": mongo.STATS_STALE_ID}) is None
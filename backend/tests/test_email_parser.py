@@ -0,0 +1,85 @@
+"""The lxml parser engine must produce exactly what the BeautifulSoup engine does."""
+import pytest
+
+from email_parser import parse_costar_email
+
+LISTING = (
+    'https://product.costar.com/home/?target=PropertyAddress&id={id}&utm_source=alert'
+)
+
+ALERT = f"""
+<html>
+<head><style>td {{ color: #333; }} .x {{ content: "Retail"; }}</style></head>
+<body>
+<table><tr><td>
+  <a href="https://product.costar.com/home/?target=ViewAllAlerts&s=1">Ohio 70 Mile</a>
+  <a href="https://product.costar.com/home/?target=ViewAllAlerts&s=1">View All</a>
+</td></tr></table>
+
+<table><tr>
+  <td><a href="{LISTING.format(id=1431229)}"><img src="https://images.costar.com/1431229.jpg" alt=""></a></td>
+  <td>
+    <a href="{LISTING.format(id=1431229)}">2695 Gilchrist Rd</a><br>
+    <a href="{LISTING.format(id=1431229)}">Akron, OH 44305 &middot; Fast Food</a>
+    <p>3,591 SF Built 1990</p>
+    <p>For Sale: $1,250,000 ($348.09/SF) 6.25% Cap Rate</p>
+  </td>
+</tr></table>
+
+<table><tr>
+  <td>
+    <a href="{LISTING.format(id=9001)}">1200 W Market St</a>
+    <a href="{LISTING.format(id=9001)}">Cuyahoga Falls, OH 44221 ･ Retail</a>
+    <span>For Sale: Price Not Disclosed</span>
+    <script>var label = "Office";</script>
+  </td>
+</tr></table>
+
+<table><tr>
+  <td>
+    <a href="{LISTING.format(id=9002)}">0 State Route 8</a>
+    <a href="{LISTING.format(id=9002)}">Stow, OH 44224</a>
+    <p>4.52 AC Commercial Land For Sale: $600,000</p>
+  </td>
+</tr></table>
+
+<table><tr><td>
+  <a href="https://product.costar.com/home/?target=ViewAllAlerts&s=2">Pittsburgh Retail</a>
+</td></tr></table>
+
+<div>
+  <a href="{LISTING.format(id=9003)}">Monroeville, PA 15146 · Drug Store</a>
+</div>
+
+<table><tr>
+  <td><a href="{LISTING.format(id=1431229)}">2695 Gilchrist Rd</a></td>
+</tr></table>
+
+<table><tr>
+  <td>
+    <a href="{LISTING.format(id=9004)}"><img src="https://images.costar.com/9004.jpg"></a>
+    <a href="{LISTING.format(id=9004)}">4000 William Penn Hwy</a>
+    <p>12,400 SF Flex Built 2004 For Sale: $2,100,000 ($169.35/SF)</p>
+  </td>
+</tr></table>
+
+<a href="https://product.costar.com/home/?target=PropertyAddress">No id</a>
+<a href="https://www.costar.com/unsubscribe">Unsubscribe</a>
+</body>
+</html>
+"""
+
+
+def test_engines_agree_on_multi_search_alert():
+    bs4_result = parse_costar_email(ALERT, 'bs4')
+    assert bs4_result == parse_costar_email(ALERT, 'lxml')
+    assert {prop['search_name'] for prop in bs4_result} == {'Ohio 70 Mile', 'Pittsburgh Retail'}
+
+
+@pytest.mark.parametrize('html', [
+    ALERT.encode('utf-8'),
+    '<html><body><p>No listings here</p></body></html>',
+    '<a href="https://product.costar.com/home/?target=PropertyAddress&id=77">12 Elm St</a>',
+])
+def test_engines_agree_on_edge_cases(html):
+    assert parse_costar_email(html, 'bs4') == parse_costar_email(html, 'lxml')
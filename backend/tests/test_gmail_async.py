@@ -0,0 +1,166 @@
+"""AsyncGmailFetcher against fake requests that inject latency and errors."""
+import asyncio
+import random
+import socket
+import threading
+import time
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import gmail_async
+from gmail_async import AsyncGmailFetcher, TokenBucket
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+class FakeRequest:
+    """Pops one scripted outcome per execute: an exception to raise or a response."""
+
+    def __init__(self, service, message_id):
+        self.service = service
+        self.message_id = message_id
+
+    def execute(self, http=None):
+        service = self.service
+        with service.lock:
+            service.in_flight += 1
+            service.max_in_flight = max(service.max_in_flight, service.in_flight)
+            service.calls.append(self.message_id)
+            outcomes = service.outcomes.get(self.message_id)
+            outcome = outcomes.pop(0) if outcomes else None
+        try:
+            time.sleep(service.latency())
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome or {"id": self.message_id}
+        finally:
+            with service.lock:
+                service.in_flight -= 1
+
+
+class FakeService:
+    """Just enough of the discovery service for messages().get()."""
+
+    def __init__(self, outcomes=None, latency=0.0):
+        self.lock = threading.Lock()
+        self.outcomes = {key: list(value) for key, value in (outcomes or {}).items()}
+        self.latency = latency if callable(latency) else (lambda: latency)
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, format):
+        return FakeRequest(self, id)
+
+
+class FakeClient:
+    def __init__(self, service):
+        self._service = service
+        self._creds = object()
+
+    def service(self):
+        return self._service
+
+    def credentials(self):
+        return self._creds
+
+
+def fetcher(service, concurrency=4, quota_per_second=100000):
+    return AsyncGmailFetcher(FakeClient(service), concurrency=concurrency, quota_per_second=quota_per_second)
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Record retry delays instead of sleeping through them."""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(gmail_async.random, "random", lambda: 0.0)
+    monkeypatch.setattr(gmail_async.asyncio, "sleep", sleep)
+    return delays
+
+
+def test_token_bucket_limits_rate():
+    async def drain():
+        bucket = TokenBucket(rate=100, capacity=10)
+        started = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire(5)
+        return time.monotonic() - started
+
+    # 50 units at 100/s, less the 10 already in the bucket
+    assert asyncio.run(drain()) >= 0.35
+
+
+def test_throttling_and_server_errors_back_off_and_retry(backoffs):
+    service = FakeService({"a": [http_error(429), http_error(503), http_error(500)]})
+
+    message = asyncio.run(fetcher(service).get_message("a"))
+
+    assert message == {"id": "a"}
+    assert service.calls == ["a"] * 4
+    assert backoffs == [1, 2, 4]
+
+
+@pytest.mark.parametrize("error", [
+    socket.timeout("timed out"),
+    ConnectionResetError(104, "Connection reset by peer"),
+    httplib2.ServerNotFoundError("Unable to find the server"),
+])
+def test_transport_errors_are_retried(backoffs, error):
+    service = FakeService({"a": [error]})
+
+    message = asyncio.run(fetcher(service).get_message("a"))
+
+    assert message == {"id": "a"}
+    assert service.calls == ["a", "a"]
+
+
+def test_non_retryable_error_is_raised(backoffs):
+    service = FakeService({"a": [http_error(400)]})
+
+    with pytest.raises(HttpError):
+        asyncio.run(fetcher(service).get_message("a"))
+
+    assert service.calls == ["a"]
+    assert backoffs == []
+
+
+def test_retries_give_up_after_max_retries(backoffs):
+    service = FakeService({"a": [http_error(503)] * (gmail_async.MAX_RETRIES + 1)})
+
+    with pytest.raises(HttpError):
+        asyncio.run(fetcher(service).get_message("a"))
+
+    assert len(service.calls) == gmail_async.MAX_RETRIES + 1
+
+
+def test_iter_messages_keeps_input_order_under_concurrency(backoffs):
+    ids = [str(i) for i in range(40)]
+    rng = random.Random(7)
+    service = FakeService(
+        {"3": [http_error(429)], "17": [http_error(404)], "25": [TimeoutError()]},
+        latency=lambda: rng.uniform(0, 0.01),
+    )
+
+    async def collect():
+        return [message["id"] async for message in fetcher(service, concurrency=4).iter_messages(ids)]
+
+    messages = asyncio.run(collect())
+
+    assert messages == [i for i in ids if i != "17"]
+    assert 1 < service.max_in_flight <= 4
@@ -0,0 +1,126 @@
+"""Gmail batch fetching against recorded multipart batch responses."""
+import json
+import re
+
+import pytest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+import gmail_service
+from gmail_service import get_messages_batched
+
+BOUNDARY = "batch_boundary"
+
+STATUS_TEXT = {200: "OK", 403: "Forbidden", 404: "Not Found", 429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+def batch_response(parts):
+    """A multipart batch response from (request_id, status) pairs."""
+    body = []
+    for request_id, status in parts:
+        payload = {"id": f"m{request_id}"} if status == 200 else {"error": {"code": status}}
+        body.append(
+            f"--{BOUNDARY}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <response-x + {request_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            "Content-Type: application/json\r\n\r\n"
+            f"{json.dumps(payload)}\r\n"
+        )
+    body.append(f"--{BOUNDARY}--")
+    headers = {"status": "200", "content-type": f'multipart/mixed; boundary="{BOUNDARY}"'}
+    return headers, "".join(body)
+
+
+def sent_ids(http):
+    """The sub-request ids sent in each batch call."""
+    return [
+        [int(i) for i in re.findall(r"Content-ID: <[^>]* \+ (\d+)>", body)]
+        for _, _, body, _ in http.request_sequence
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gmail_service.time, "sleep", lambda seconds: None)
+
+
+def service_for(responses):
+    http = HttpMockSequence(responses)
+    return build_from_document(get_static_doc("gmail", "v1"), http=http), http
+
+
+def test_results_keep_input_order():
+    # The server answers out of order; results follow the input ids
+    service, http = service_for([batch_response([(2, 200), (0, 200), (1, 200)])])
+
+    messages = get_messages_batched(service, ["a", "b", "c"])
+
+    assert [m["id"] for m in messages] == ["m0", "m1", "m2"]
+    assert sent_ids(http) == [[0, 1, 2]]
+
+
+def test_deleted_message_is_none():
+    service, _ = service_for([batch_response([(0, 200), (1, 404), (2, 200)])])
+
+    messages = get_messages_batched(service, ["a", "b", "c"])
+
+    assert messages[1] is None
+    assert [m["id"] for m in messages if m] == ["m0", "m2"]
+
+
+def test_only_failed_sub_requests_are_resent():
+    service, http = service_for([
+        batch_response([(0, 200), (1, 429), (2, 200), (3, 503)]),
+        batch_response([(1, 200), (3, 200)]),
+    ])
+
+    messages = get_messages_batched(service, ["a", "b", "c", "d"])
+
+    assert [m["id"] for m in messages] == ["m0", "m1", "m2", "m3"]
+    assert sent_ids(http) == [[0, 1, 2, 3], [1, 3]]
+
+
+def test_batches_split_at_batch_size():
+    service, http = service_for([
+        batch_response([(0, 200), (1, 200)]),
+        batch_response([(2, 200)]),
+    ])
+
+    messages = get_messages_batched(service, ["a", "b", "c"], batch_size=2)
+
+    assert len(messages) == 3
+    assert sent_ids(http) == [[0, 1], [2]]
+
+
+def test_non_retryable_error_is_raised():
+    service, http = service_for([batch_response([(0, 200), (1, 403)])])
+
+    with pytest.raises(HttpError) as error:
+        get_messages_batched(service, ["a", "b"])
+
+    assert error.value.resp.status == 403
+    assert len(http.request_sequence) == 1
+
+
+def test_retries_give_up_after_the_limit():
+    service, http = service_for([batch_response([(0, 503)])] * 3)
+
+    with pytest.raises(HttpError):
+        get_messages_batched(service, ["a"], retries=2)
+
+    assert sent_ids(http) == [[0], [0], [0]]
+
+
+def test_batch_size_is_capped_at_gmail_limit():
+    service, http = service_for([
+        batch_response([(i, 200) for i in range(100)]),
+        batch_response([(100, 200)]),
+    ])
+
+    messages = get_messages_batched(service, [str(i) for i in range(101)], batch_size=500)
+
+    assert len(messages) == 101
+    assert [len(ids) for ids in sent_ids(http)] == [100, 1]
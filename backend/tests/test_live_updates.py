@@ -0,0 +1,76 @@
+"""Live update fan-out: the change stream fallback and the polling window."""
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import live_updates
+from live_updates import LiveUpdates, CHANGE_STREAMS_UNSUPPORTED
+
+
+class Recorder(LiveUpdates):
+    """LiveUpdates that records published batches instead of encoding them."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def publish(self, inserted, updated):
+        self.batches.append(([doc["costar_id"] for doc in inserted], [doc["costar_id"] for doc in updated]))
+
+
+def test_polling_errors_are_retried_without_reopening_the_stream(monkeypatch):
+    monkeypatch.setattr(live_updates, "LIVE_RETRY_SECONDS", 0)
+    live = LiveUpdates()
+    live.subscribers.add(asyncio.Queue())
+    calls = []
+
+    async def watch():
+        calls.append("watch")
+        raise OperationFailure("$changeStream stage is only supported on replica sets", code=CHANGE_STREAMS_UNSUPPORTED)
+
+    async def poll():
+        calls.append("poll")
+        if calls.count("poll") == 1:
+            raise AutoReconnect("connection reset")
+        live.subscribers.clear()
+
+    live._watch, live._poll = watch, poll
+    asyncio.run(live._run())
+
+    assert calls == ["watch", "poll", "poll"]
+
+
+def listing(costar_id, updated_at, created_at=None):
+    return {"costar_id": costar_id, "updated_at": updated_at, "created_at": created_at or updated_at}
+
+
+def test_poll_window_publishes_late_commits_once(mongo, monkeypatch):
+    monkeypatch.setattr(live_updates, "LIVE_BATCH_LIMIT", 2)
+    start = datetime(2026, 1, 1, 12, 0, 0)
+    live = Recorder()
+    live._poll_since = live._poll_newest = start
+    collection = live_updates.async_database.db["properties"]
+
+    async def passes():
+        # A bulk write stamps several listings with one time; paging must not lose ties
+        tied = start + timedelta(seconds=2)
+        await collection.insert_many([listing("a", tied), listing("b", tied), listing("c", tied)])
+        await live._poll_window(collection)
+        # Stamped before "a" but committed after it had been published
+        await collection.insert_one(listing("late", start + timedelta(seconds=1)))
+        await collection.update_one(
+            {"costar_id": "a"}, {"$set": {"updated_at": start + timedelta(seconds=3)}}
+        )
+        await live._poll_window(collection)
+        await live._poll_window(collection)
+
+    asyncio.run(passes())
+
+    assert live.batches == [
+        (["a", "b"], []),
+        (["c"], []),
+        # Second pass: "b" and "c" are re-read inside the window but not re-sent
+        (["late"], []),
+        ([], ["a"]),
+    ]
@@ -4,6 +4,15 @@ import './App.css';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
+// Add per-key count changes to a stats breakdown
+const addCounts = (counts, delta) => {
+  const result = { ...counts };
+  Object.entries(delta).forEach(([key, value]) => {
+    result[key] = (result[key] || 0) + value;
+  });
+  return result;
+};
+
 // Property Card Component
 const PropertyCard = ({ property }) => {
   const [imageError, setImageError] = useState(false);
@@ -201,6 +210,7 @@ function App() {
   const [stats, setStats] = useState({ total_properties: 0, by_state: {}, by_type: {} });
   const [syncStatus, setSyncStatus] = useState({ configured: false, message: '' });
   const [syncing, setSyncing] = useState(false);
+  const [syncProgress, setSyncProgress] = useState(null);
   const [seeding, setSeeding] = useState(false);
   const [filters, setFilters] = useState({ city: '', state: '', property_type: '' });
 
@@ -251,13 +261,23 @@ function App() {
     setSyncing(true);
     try {
       const response = await axios.post(`${API_URL}/api/sync-emails?days_back=30&max_emails=100`);
-      alert(`Sync complete! Found ${response.data.total_found} properties, added ${response.data.new_added} new.`);
-      fetchProperties();
-      fetchStats();
+      let job = response.data;
+      // The sync runs in the background; poll the job until it finishes
+      while (job.status === 'running') {
+        setSyncProgress(job.progress);
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        job = (await axios.get(`${API_URL}/api/sync-jobs/${job.id}`)).data;
+      }
+      if (job.status === 'completed') {
+        alert(`Sync complete! Found ${job.result.total_found} properties, added ${job.result.new_added} new.`);
+      } else {
+        alert(job.error || `Sync ${job.status}.`);
+      }
     } catch (err) {
       alert(err.response?.data?.detail || 'Sync failed. Please check Gmail credentials.');
     } finally {
       setSyncing(false);
+      setSyncProgress(null);
     }
   };
 
@@ -283,6 +303,40 @@ function App() {
     checkSyncStatus();
   }, [fetchProperties]);
 
+  // New and updated listings pushed by the server, whoever ran the sync
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/api/live`);
+    const filtered = filters.city || filters.state || filters.property_type;
+
+    source.addEventListener('properties', (event) => {
+      const { inserted, updated } = JSON.parse(event.data);
+      if (filtered && inserted.length) {
+        // Only the server knows which new listings match the filters
+        fetchProperties();
+        return;
+      }
+      setProperties((current) => {
+        const changed = new Map(updated.map((property) => [property.id, property]));
+        const merged = current.map((property) => changed.get(property.id) || property);
+        return [...inserted.reverse(), ...merged].slice(0, 100);
+      });
+    });
+    source.addEventListener('stats', (event) => {
+      const delta = JSON.parse(event.data);
+      setStats((current) => ({
+        total_properties: current.total_properties + delta.total_properties,
+        by_state: addCounts(current.by_state, delta.by_state),
+        by_type: addCounts(current.by_type, delta.by_type),
+      }));
+    });
+    source.addEventListener('resync', () => {
+      fetchProperties();
+      fetchStats();
+    });
+
+    return () => source.close();
+  }, [fetchProperties, filters]);
+
   // Extract unique states and property types from stats
   const states = Object.keys(stats.by_state).sort();
   const propertyTypes = Object.keys(stats.by_type).sort();
@@ -339,7 +393,9 @@ function App() {
                       <circle className="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" strokeWidth="4" fill="none"></circle>
                       <path className="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path>
                     </svg>
-                    Syncing...
+                    {syncProgress?.messages_fetched
+                      ? `Syncing... ${syncProgress.messages_fetched} emails, ${syncProgress.properties_inserted} new`
+                      : 'Syncing...'}
                   </>
                 ) : (
                   <>